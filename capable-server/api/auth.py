@@ -1,9 +1,16 @@
-from fastapi import Depends, HTTPException, status
+import hmac
+import os
+
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from api.database import get_supabase
 
 security = HTTPBearer()
 
+# Read once at import; Vercel cron requests send "Bearer <CRON_SECRET>".
+CRON_SECRET = os.getenv("CRON_SECRET", "")
+_CRON_EXPECTED_HEADER = f"Bearer {CRON_SECRET}".encode() if CRON_SECRET else b""
+
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
@@ -25,3 +32,14 @@ async def get_current_user(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=str(e),
         )
+
+
+async def verify_cron_secret(authorization: str = Header("")) -> None:
+    """Verify the Vercel cron secret. Open when CRON_SECRET is unset."""
+    if _CRON_EXPECTED_HEADER and not hmac.compare_digest(
+        authorization.encode(), _CRON_EXPECTED_HEADER
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthorized",
+        )
@@ -1,5 +1,7 @@
 import os
-from supabase import create_client, Client
+
+import httpx
+from supabase import create_client, Client, ClientOptions
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,12 +9,30 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY", "")
 
+# One keep-alive connection pool shared by every client, so repeated
+# .execute() calls reuse TCP/TLS connections instead of reconnecting.
+_HTTP_CLIENT = httpx.Client(
+    limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+    timeout=30,
+)
+
+
+def _create_client() -> Client:
+    return create_client(
+        SUPABASE_URL,
+        SUPABASE_SERVICE_KEY,
+        options=ClientOptions(httpx_client=_HTTP_CLIENT),
+    )
+
 
 def get_supabase() -> Client:
-    """Fresh client per request — avoids auth state pollution from shared instances."""
-    return create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+    """Fresh client per request — avoids auth state pollution from shared instances.
+
+    Only the underlying connection pool is shared; session state stays per client.
+    """
+    return _create_client()
 
 
 def get_supabase_admin() -> Client:
     """Client using the service role key — bypasses RLS. Use only for trusted server-side operations."""
-    return create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+    return _create_client()
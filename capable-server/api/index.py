@@ -1,11 +1,15 @@
 import asyncio
-import os
+from contextlib import asynccontextmanager
+from uuid import UUID
 
-from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi import FastAPI, HTTPException, Depends, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
+from postgrest.exceptions import APIError
+from pydantic import TypeAdapter
 
 from api.database import get_supabase
-from api.auth import get_current_user
+from api.auth import get_current_user, verify_cron_secret
+from api.responses import ORJSONResponse
 from api.schemas import (
     ExperimentCreate,
     ExperimentUpdate,
@@ -19,6 +23,7 @@ from api.schemas import (
 )
 from api.cron import run_pickup_cron, run_sync_studies_cron
 from api.peptides import (
+    close_openai_client,
     run_sync_peptides_cron,
     run_backfill_experiment_peptides,
     sync_experiment_peptides_for_experiment_ids,
@@ -26,15 +31,25 @@ from api.peptides import (
 from api.peptide_sequences import run_backfill_peptide_sequences
 from api.peptide_notes import run_backfill_peptide_notes
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await close_openai_client()
+
+
 app = FastAPI(
     title="Axonic API",
     description="Axonic Server API",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 sequence_backfill_task: asyncio.Task | None = None
 notes_backfill_task: asyncio.Task | None = None
 
+MAX_PAGE_SIZE = 1000
+
 all_vercel_previews = r"https://.*\.vercel\.app"
 localhost = r"http://localhost(:\d+)?"
 
@@ -44,6 +59,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Offset"],
 )
 
 
@@ -61,6 +77,65 @@ def _extract_linked_experiment_ids(value: object) -> set[str]:
     return ids
 
 
+def _resolve_experiment_links(
+    supabase, experiment_ids: list[str]
+) -> list[dict[str, str]]:
+    """Build [{experiment_name: experiment_id}] links with a single IN query."""
+    if not experiment_ids:
+        return []
+    result = (
+        supabase.table("experiments")
+        .select("id, name")
+        .in_("id", list(dict.fromkeys(experiment_ids)))
+        .execute()
+    )
+    rows_by_id = {str(row["id"]).lower(): row for row in result.data or []}
+
+    experiments = []
+    not_found = []
+    for exp_id in experiment_ids:
+        exp = rows_by_id.get(str(exp_id).lower())
+        if exp is None:
+            not_found.append(exp_id)
+        else:
+            experiments.append({exp["name"]: str(exp["id"])})
+
+    if not_found:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Experiments not found: {', '.join(not_found)}",
+        )
+    return experiments
+
+
+def _raise_for_duplicate_name(exc: APIError, name: str | None) -> None:
+    # 23505 = unique_violation on peptides_name_key.
+    if exc.code == "23505":
+        raise HTTPException(
+            status_code=409,
+            detail=f"Peptide '{name}' already exists",
+        )
+
+
+# Validates and serializes a whole experiments page in one pass.
+EXPERIMENT_LIST_ADAPTER = TypeAdapter(list[ExperimentResponse])
+EXPERIMENT_COLUMNS = ", ".join(ExperimentResponse.model_fields)
+
+
+def _page_headers(count: int, limit: int | None, offset: int) -> dict[str, str]:
+    """X-Next-Offset is set when a full page was returned."""
+    headers = {}
+    if limit is not None and count == limit:
+        headers["X-Next-Offset"] = str(offset + limit)
+    return headers
+
+
+def _page_response(
+    rows: list[dict], limit: int | None, offset: int
+) -> ORJSONResponse:
+    return ORJSONResponse(rows, headers=_page_headers(len(rows), limit, offset))
+
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to Capable API"}
@@ -88,7 +163,7 @@ async def login(user: UserLogin):
             raise HTTPException(status_code=401, detail="Invalid credentials")
         return AuthResponse(
             access_token=response.session.access_token,
-            user_id=str(response.user.id),
+            user_id=response.user.id,
             email=response.user.email,
         )
     except Exception as e:
@@ -108,7 +183,7 @@ async def logout(user=Depends(get_current_user)):
 @app.get("/auth/me")
 async def get_me(user=Depends(get_current_user)):
     return {
-        "id": str(user.id),
+        "id": user.id,
         "email": user.email,
     }
 
@@ -153,15 +228,37 @@ async def create_experiment(
     return result.data[0]
 
 
-@app.get("/experiments", response_model=list[ExperimentResponse])
-async def get_experiments(user=Depends(get_current_user)):
+# The handler renders its own Response, so the schema is declared for
+# OpenAPI only.
+@app.get(
+    "/experiments",
+    response_model=None,
+    responses={200: {"model": list[ExperimentResponse]}},
+)
+async def get_experiments(
+    user=Depends(get_current_user),
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+):
     supabase = get_supabase()
-    result = supabase.table("experiments").select("*").execute()
-    return result.data
+    query = supabase.table("experiments").select(EXPERIMENT_COLUMNS)
+    if limit is not None:
+        query = query.order("row_created_at").order("id").range(
+            offset, offset + limit - 1
+        )
+    result = query.execute()
+    # Same validation and serialization as response_model, but done once for
+    # the whole list by pydantic-core instead of through jsonable_encoder.
+    experiments = EXPERIMENT_LIST_ADAPTER.validate_python(result.data)
+    return Response(
+        EXPERIMENT_LIST_ADAPTER.dump_json(experiments),
+        media_type="application/json",
+        headers=_page_headers(len(experiments), limit, offset),
+    )
 
 
 @app.get("/experiments/{experiment_id}", response_model=ExperimentResponse)
-async def get_experiment(experiment_id: str, user=Depends(get_current_user)):
+async def get_experiment(experiment_id: UUID, user=Depends(get_current_user)):
     supabase = get_supabase()
     result = (
         supabase.table("experiments")
@@ -176,7 +273,7 @@ async def get_experiment(experiment_id: str, user=Depends(get_current_user)):
 
 @app.put("/experiments/{experiment_id}", response_model=ExperimentResponse)
 async def update_experiment(
-    experiment_id: str,
+    experiment_id: UUID,
     experiment: ExperimentUpdate,
     user=Depends(get_current_user),
 ):
@@ -226,7 +323,7 @@ async def update_experiment(
 
 
 @app.delete("/experiments/{experiment_id}")
-async def delete_experiment(experiment_id: str, user=Depends(get_current_user)):
+async def delete_experiment(experiment_id: UUID, user=Depends(get_current_user)):
     supabase = get_supabase()
     result = (
         supabase.table("experiments").delete().eq("id", experiment_id).execute()
@@ -239,14 +336,21 @@ async def delete_experiment(experiment_id: str, user=Depends(get_current_user)):
 # --- Peptides (protected) ---
 
 
-@app.get("/peptides")
-async def get_peptides(user=Depends(get_current_user)):
+@app.get("/peptides", response_class=ORJSONResponse)
+async def get_peptides(
+    user=Depends(get_current_user),
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+):
     supabase = get_supabase()
-    result = supabase.table("peptides").select("*").execute()
-    return result.data
+    query = supabase.table("peptides").select("*")
+    if limit is not None:
+        query = query.order("id").range(offset, offset + limit - 1)
+    result = query.execute()
+    return _page_response(result.data, limit, offset)
 
 
-@app.get("/peptides/{peptide_id}")
+@app.get("/peptides/{peptide_id}", response_class=ORJSONResponse)
 async def get_peptide(peptide_id: int, user=Depends(get_current_user)):
     supabase = get_supabase()
     result = supabase.table("peptides").select("*").eq("id", peptide_id).execute()
@@ -262,52 +366,23 @@ async def create_peptide(
 ):
     supabase = get_supabase()
 
-    # Validate experiment IDs and build experiments list
-    experiments = []
-    not_found = []
-    for exp_id in peptide.experiment_ids:
+    experiments = _resolve_experiment_links(supabase, peptide.experiment_ids)
+
+    try:
         result = (
-            supabase.table("experiments")
-            .select("id, name")
-            .eq("id", exp_id)
+            supabase.table("peptides")
+            .insert(
+                {
+                    "name": peptide.name,
+                    "sequence": peptide.sequence,
+                    "experiments": experiments,
+                }
+            )
             .execute()
         )
-        if not result.data:
-            not_found.append(exp_id)
-        else:
-            exp = result.data[0]
-            experiments.append({exp["name"]: str(exp["id"])})
-
-    if not_found:
-        raise HTTPException(
-            status_code=404,
-            detail=f"Experiments not found: {', '.join(not_found)}",
-        )
-
-    # Check for duplicate peptide name
-    existing = (
-        supabase.table("peptides")
-        .select("id")
-        .eq("name", peptide.name)
-        .execute()
-    )
-    if existing.data:
-        raise HTTPException(
-            status_code=409,
-            detail=f"Peptide '{peptide.name}' already exists",
-        )
-
-    result = (
-        supabase.table("peptides")
-        .insert(
-            {
-                "name": peptide.name,
-                "sequence": peptide.sequence,
-                "experiments": experiments,
-            }
-        )
-        .execute()
-    )
+    except APIError as exc:
+        _raise_for_duplicate_name(exc, peptide.name)
+        raise
 
     if not result.data:
         raise HTTPException(status_code=500, detail="Failed to create peptide")
@@ -358,52 +433,27 @@ async def update_peptide(
     data = {}
 
     if peptide.name is not None:
-        # Check for duplicate name (excluding this peptide)
-        existing = (
-            supabase.table("peptides")
-            .select("id")
-            .eq("name", peptide.name)
-            .neq("id", peptide_id)
-            .execute()
-        )
-        if existing.data:
-            raise HTTPException(
-                status_code=409,
-                detail=f"Peptide '{peptide.name}' already exists",
-            )
         data["name"] = peptide.name
 
     if peptide.sequence is not None:
         data["sequence"] = peptide.sequence
 
     if peptide.experiment_ids is not None:
-        experiments = []
-        not_found = []
-        for exp_id in peptide.experiment_ids:
-            result = (
-                supabase.table("experiments")
-                .select("id, name")
-                .eq("id", exp_id)
-                .execute()
-            )
-            if not result.data:
-                not_found.append(exp_id)
-            else:
-                exp = result.data[0]
-                experiments.append({exp["name"]: str(exp["id"])})
-        if not_found:
-            raise HTTPException(
-                status_code=404,
-                detail=f"Experiments not found: {', '.join(not_found)}",
-            )
-        data["experiments"] = experiments
+        data["experiments"] = _resolve_experiment_links(
+            supabase, peptide.experiment_ids
+        )
 
     if not data:
         raise HTTPException(status_code=400, detail="No fields to update")
 
-    result = (
-        supabase.table("peptides").update(data).eq("id", peptide_id).execute()
-    )
+    try:
+        result = (
+            supabase.table("peptides").update(data).eq("id", peptide_id).execute()
+        )
+    except APIError as exc:
+        _raise_for_duplicate_name(exc, peptide.name)
+        raise
+
     if not result.data:
         raise HTTPException(status_code=404, detail="Peptide not found")
 
@@ -456,53 +506,34 @@ async def delete_peptide(peptide_id: int, user=Depends(get_current_user)):
 # --- Cron ---
 
 
-@app.get("/cron/pickup-files")
-async def cron_pickup_files(request: Request):
-    # Verify Vercel cron secret
-    cron_secret = os.getenv("CRON_SECRET", "")
-    auth_header = request.headers.get("authorization", "")
-    if cron_secret and auth_header != f"Bearer {cron_secret}":
-        raise HTTPException(status_code=401, detail="Unauthorized")
+@app.get("/cron/pickup-files", dependencies=[Depends(verify_cron_secret)])
+async def cron_pickup_files():
     return await run_pickup_cron()
 
 
-@app.get("/cron/sync-studies")
-async def cron_sync_studies(request: Request):
-    # Verify Vercel cron secret
-    cron_secret = os.getenv("CRON_SECRET", "")
-    auth_header = request.headers.get("authorization", "")
-    if cron_secret and auth_header != f"Bearer {cron_secret}":
-        raise HTTPException(status_code=401, detail="Unauthorized")
+@app.get("/cron/sync-studies", dependencies=[Depends(verify_cron_secret)])
+async def cron_sync_studies():
     return await run_sync_studies_cron()
 
 
-@app.get("/cron/sync-peptides")
-async def cron_sync_peptides(request: Request, limit: int | None = None):
-    # Verify Vercel cron secret
-    cron_secret = os.getenv("CRON_SECRET", "")
-    auth_header = request.headers.get("authorization", "")
-    if cron_secret and auth_header != f"Bearer {cron_secret}":
-        raise HTTPException(status_code=401, detail="Unauthorized")
+@app.get("/cron/sync-peptides", dependencies=[Depends(verify_cron_secret)])
+async def cron_sync_peptides(limit: int | None = None):
     return await run_sync_peptides_cron(limit=limit)
 
 
-@app.get("/cron/backfill-experiment-peptides")
-async def cron_backfill_experiment_peptides(request: Request):
-    # Verify Vercel cron secret
-    cron_secret = os.getenv("CRON_SECRET", "")
-    auth_header = request.headers.get("authorization", "")
-    if cron_secret and auth_header != f"Bearer {cron_secret}":
-        raise HTTPException(status_code=401, detail="Unauthorized")
+@app.get(
+    "/cron/backfill-experiment-peptides",
+    dependencies=[Depends(verify_cron_secret)],
+)
+async def cron_backfill_experiment_peptides():
     return await run_backfill_experiment_peptides()
 
 
-@app.post("/cron/backfill-peptide-sequences")
-async def cron_backfill_peptide_sequences(request: Request):
-    # Verify Vercel cron secret
-    cron_secret = os.getenv("CRON_SECRET", "")
-    auth_header = request.headers.get("authorization", "")
-    if cron_secret and auth_header != f"Bearer {cron_secret}":
-        raise HTTPException(status_code=401, detail="Unauthorized")
+@app.post(
+    "/cron/backfill-peptide-sequences",
+    dependencies=[Depends(verify_cron_secret)],
+)
+async def cron_backfill_peptide_sequences():
     global sequence_backfill_task
     if sequence_backfill_task and not sequence_backfill_task.done():
         return {
@@ -526,14 +557,8 @@ async def cron_backfill_peptide_sequences(request: Request):
     }
 
 
-@app.post("/cron/backfill-peptide-notes")
-async def cron_backfill_peptide_notes(request: Request):
-    # Verify Vercel cron secret
-    cron_secret = os.getenv("CRON_SECRET", "")
-    auth_header = request.headers.get("authorization", "")
-    if cron_secret and auth_header != f"Bearer {cron_secret}":
-        raise HTTPException(status_code=401, detail="Unauthorized")
-
+@app.post("/cron/backfill-peptide-notes", dependencies=[Depends(verify_cron_secret)])
+async def cron_backfill_peptide_notes():
     global notes_backfill_task
     if notes_backfill_task and not notes_backfill_task.done():
         return {
@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import json
+import os
+from typing import Awaitable, Callable
+
+import modal
+
+from api.database import get_supabase
+from api.utils import normalize_target_ids
+
+DB_WRITE_BATCH_SIZE = 100
+DB_WRITE_BATCH_WAIT_SECONDS = 0.2
+PEPTIDE_LOG_MAX_CHARS = max(
+    1000,
+    int(os.getenv("PEPTIDE_LOG_MAX_CHARS", "25000")),
+)
+
+
+def _trim_text(value: object) -> str:
+    if not value:
+        return ""
+    text = value if isinstance(value, str) else str(value)
+    if len(text) > PEPTIDE_LOG_MAX_CHARS:
+        # Slice before stripping so large outputs are never scanned in full.
+        return text[:PEPTIDE_LOG_MAX_CHARS].strip() + " ...[truncated]"
+    return text.strip()
+
+
+def _log_payload(
+    result: dict[str, object],
+    source: str,
+    extra_fields: tuple[str, ...],
+) -> str:
+    payload = {
+        "source": source,
+        "status": str(result.get("status") or ""),
+        **{name: _trim_text(result.get(name)) for name in extra_fields},
+        "error": _trim_text(result.get("error")),
+        "raw_output": _trim_text(result.get("raw_output")),
+    }
+    return json.dumps(payload, ensure_ascii=True)
+
+
+@functools.lru_cache(maxsize=4)
+def _get_modal_function(app_name: str, function_name: str) -> modal.Function:
+    """Resolve a deployed Modal function once per process; failed lookups are
+    not cached, so a later run can retry."""
+    return modal.Function.from_name(app_name, function_name)
+
+
+async def _drain_queue(
+    writer_queue: asyncio.Queue[dict[str, object] | None],
+    write_batch: Callable[[list[dict[str, object]]], Awaitable[None]],
+) -> None:
+    """Writer loop: batch up to DB_WRITE_BATCH_SIZE queued rows, waiting at
+    most DB_WRITE_BATCH_WAIT_SECONDS, into one write until a None sentinel."""
+    loop = asyncio.get_running_loop()
+    while True:
+        row = await writer_queue.get()
+        if row is None:
+            return
+        batch = [row]
+        stop = False
+        deadline = loop.time() + DB_WRITE_BATCH_WAIT_SECONDS
+        while len(batch) < DB_WRITE_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                row = await asyncio.wait_for(writer_queue.get(), timeout)
+            except TimeoutError:
+                break
+            if row is None:
+                stop = True
+                break
+            batch.append(row)
+        await write_batch(batch)
+        if stop:
+            return
+
+
+async def run_peptide_field_backfill(
+    *,
+    field: str,
+    app_name: str,
+    function_name: str,
+    log_source: str,
+    extra_log_fields: tuple[str, ...] = (),
+    max_parallel: int = 25,
+    db_writers: int = 4,
+    peptide_ids: list[int] | None = None,
+) -> dict[str, int | bool | str]:
+    """Fill an empty peptides.<field> column by fanning Codex jobs out to Modal.
+
+    Shared by the notes and sequence backfills, which differ only in the
+    column, Modal function, and log payload they use. At most max_parallel
+    Modal calls are in flight at once.
+    """
+    supabase = get_supabase()
+    target_ids = normalize_target_ids(peptide_ids)
+
+    query = supabase.table("peptides").select(f"id, name, {field}")
+    if target_ids is not None:
+        if not target_ids:
+            return {
+                "success": True,
+                "updated": 0,
+                "skipped": 0,
+                "failed": 0,
+                "total_considered": 0,
+                "total_submitted": 0,
+                "message": "No peptide IDs provided",
+            }
+        query = query.in_("id", target_ids)
+
+    rows = (await asyncio.to_thread(query.execute)).data or []
+    if not rows:
+        return {
+            "success": True,
+            "updated": 0,
+            "skipped": 0,
+            "failed": 0,
+            "total_considered": 0,
+            "total_submitted": 0,
+            "message": "No peptides found",
+        }
+
+    updated = 0
+    skipped = 0
+    failed = 0
+    first_error = ""
+    jobs: list[dict[str, object]] = []
+
+    # PostgREST returns bigint ids as ints and text columns as str | None.
+    for row in rows:
+        peptide_id = row.get("id")
+        if peptide_id is None:
+            failed += 1
+            continue
+        if (row.get(field) or "").strip():
+            skipped += 1
+            continue
+        peptide_name = (row.get("name") or "").strip()
+        if not peptide_name:
+            failed += 1
+            continue
+
+        jobs.append({"peptide_id": peptide_id, "name": peptide_name})
+
+    if not jobs:
+        return {
+            "success": True,
+            "updated": updated,
+            "skipped": skipped,
+            "failed": failed,
+            "total_considered": len(rows),
+            "total_submitted": 0,
+        }
+
+    try:
+        fn = _get_modal_function(app_name, function_name)
+    except Exception as exc:
+        return {
+            "success": False,
+            "updated": updated,
+            "skipped": skipped,
+            "failed": failed + len(jobs),
+            "total_considered": len(rows),
+            "total_submitted": len(jobs),
+            "error": str(exc),
+        }
+
+    # Counters are only touched from coroutines on the event loop thread;
+    # blocking Supabase calls run in worker threads via asyncio.to_thread.
+    def record_failure(count: int, message: str) -> None:
+        nonlocal failed, first_error
+        failed += count
+        if not first_error:
+            first_error = message
+
+    async def update_row(row: dict[str, object]) -> bool:
+        # UPDATE rather than upsert: a peptide deleted mid-run must stay
+        # deleted instead of coming back as a partial row.
+        values = {key: value for key, value in row.items() if key != "id"}
+        write_result = await asyncio.to_thread(
+            supabase.table("peptides").update(values).eq("id", row["id"]).execute
+        )
+        return bool(write_result.data)
+
+    async def write_batch(rows: list[dict[str, object]]) -> None:
+        nonlocal updated, first_error
+        outcomes = await asyncio.gather(
+            *(update_row(row) for row in rows),
+            return_exceptions=True,
+        )
+        for row, outcome in zip(rows, outcomes):
+            peptide_id = row["id"]
+            if field not in row:
+                if outcome is not True and not first_error:
+                    first_error = f"Log write failed for peptide {peptide_id}"
+            elif outcome is True:
+                updated += 1
+            elif isinstance(outcome, BaseException):
+                record_failure(1, f"DB update failed for peptide {peptide_id}")
+            else:
+                record_failure(1, f"Peptide {peptide_id} no longer exists")
+
+    def process_one_result(result: dict[str, object]) -> dict[str, object] | None:
+        nonlocal skipped
+
+        try:
+            peptide_id = int(result.get("peptide_id"))
+        except Exception:
+            record_failure(1, "Malformed Modal result payload")
+            return None
+
+        logs_text = _log_payload(result, log_source, extra_log_fields)
+
+        if str(result.get("status") or "") != "ok":
+            record_failure(1, str(result.get("error") or "Modal worker failed"))
+            return {"id": peptide_id, "logs": logs_text}
+
+        value = str(result.get(field) or "").strip()
+        if not value:
+            skipped += 1
+            return {"id": peptide_id, "logs": logs_text}
+
+        return {"id": peptide_id, field: value, "logs": logs_text}
+
+    writer_queue: asyncio.Queue[dict[str, object] | None] = asyncio.Queue()
+    writers = [
+        asyncio.create_task(_drain_queue(writer_queue, write_batch))
+        for _ in range(db_writers)
+    ]
+
+    call_sem = asyncio.Semaphore(max_parallel)
+
+    async def call_modal(
+        job: dict[str, object],
+    ) -> tuple[dict[str, object], dict[str, object] | BaseException]:
+        async with call_sem:
+            try:
+                return job, await fn.remote.aio(job)
+            except Exception as exc:
+                return job, exc
+
+    # Results are only queued here; the writer coroutines batch them into
+    # concurrent updates so DB latency never blocks awaiting the next result.
+    try:
+        for next_result in asyncio.as_completed([call_modal(job) for job in jobs]):
+            job, result = await next_result
+            if isinstance(result, BaseException):
+                # Worker errors come back as status payloads, so an exception
+                # here is an infrastructure failure for this job's peptide.
+                peptide_id = job["peptide_id"]
+                record_failure(
+                    1, f"Modal call failed for peptide {peptide_id}: {result}"
+                )
+                failure = {"status": "failed", "error": str(result)}
+                writer_queue.put_nowait({
+                    "id": peptide_id,
+                    "logs": _log_payload(failure, log_source, extra_log_fields),
+                })
+                continue
+            row = process_one_result(result)
+            if row is None:
+                continue
+            writer_queue.put_nowait(row)
+    finally:
+        # Always stop the writers, so rows already queued are written even
+        # when a Modal call raises past the handler above.
+        for _ in writers:
+            writer_queue.put_nowait(None)
+        await asyncio.gather(*writers)
+
+    if failed > 0 and updated == 0 and skipped == 0:
+        return {
+            "success": False,
+            "updated": updated,
+            "skipped": skipped,
+            "failed": failed,
+            "total_considered": len(rows),
+            "total_submitted": len(jobs),
+            "error": first_error or f"All peptide {field} jobs failed",
+        }
+
+    return {
+        "success": True,
+        "updated": updated,
+        "skipped": skipped,
+        "failed": failed,
+        "total_considered": len(rows),
+        "total_submitted": len(jobs),
+        "error": first_error or None,
+    }
@@ -1,16 +1,24 @@
 import asyncio
-import json
+import hashlib
 import os
 import re
+import weakref
 
+import httpx
+import orjson
 from openai import AsyncOpenAI
 
 from api.database import get_supabase_admin
 from api.peptide_sequences import run_backfill_peptide_sequences
 
 
+# Part of every peptide_name_cache key — bump whenever EXTRACTION_PROMPT,
+# EXTRACTION_RESPONSE_FORMAT or the _fast_extract rules change so stale
+# extractions stop matching.
+EXTRACTION_PROMPT_VERSION = "1"
+
 EXTRACTION_PROMPT = """\
-Extract peptide identifiers from this experiment name. Return a JSON array of peptide name strings.
+Extract peptide identifiers from each numbered experiment name below. Return a JSON object of the form {"results": [{"index": <number>, "peptides": [...]}]} with one entry per experiment name, listing peptide name strings.
 
 Peptides are of the form: OXNv3.1 i.e. version number if available. We mostly look at orexin and NPS. Orexins are OXNB if not stated otherwise.
 
@@ -30,58 +38,339 @@ Additional rules:
 - If a bare name like "NPS" appears alongside versioned forms, use the versioned form
 - Freely floating numbers after a peptide name are version numbers, not doses (e.g. "OXN 2" -> "OXNv2", "NPS 3" -> "NPSv3"). This does NOT apply when the number has dosing units (e.g. "OXN 50nmol" — the 50 is a dose, not a version)
 - "NPSVv1" is NOT a valid peptide — the correct name is "NPSv1"
-- Return an empty array [] if no peptides are found
-- Return ONLY the JSON array, nothing else"""
-
-
-_client: AsyncOpenAI | None = None
+- Treat each experiment name independently; use an empty peptides array for a name with no peptides"""
+
+# Deterministic pre-parser for names made only of well-formed peptide tokens
+# joined by "+" (e.g. "TAK 861+NPS v5.2"), applying the same rules as
+# EXTRACTION_PROMPT. Anything else — extra words, doses, bare OXN/Orexin
+# (OXN vs OXNB is a judgment call), unversioned bases — goes to OpenAI.
+_FAST_PEPTIDE_RE = re.compile(
+    r"(?P<base>TAK|aMCH|NPS|NXN|OXNA|OXNB|OXA|OXB)\s*(?:v\s*)?(?P<ver>\d+(?:\.\d+)*)?"
+)
+_FAST_BASE_ALIASES = {"OXA": "OXNA", "OXB": "OXNB"}
+_NON_PEPTIDE_TOKENS = {"placebo", "vehicle", "saline", "caffeine", "pbs", "tmc"}
+
+# Max peptide names per PostgREST in.() filter; keeps request URLs bounded.
+NAME_FILTER_CHUNK_SIZE = 200
+
+# Rows per page when scanning the whole peptides table (Supabase's default
+# max_rows, so a page is never silently truncated below this size).
+PEPTIDE_PAGE_SIZE = 1000
+
+# experiments.peptides UPDATEs allowed in flight at once.
+EXPERIMENT_WRITE_CONCURRENCY = 16
+
+# peptides.experiments UPDATEs allowed in flight at once during the sync cron.
+PEPTIDE_WRITE_CONCURRENCY = 16
+
+# Experiment names sent per OpenAI call, so the prompt is paid once per batch.
+EXTRACTION_BATCH_SIZE = 20
+
+# Uncached name counts at or above this go through the OpenAI Batch API
+# (half price, but asynchronous); 0 disables it. The cron waits at most
+# OPENAI_BATCH_MAX_WAIT_SECONDS — keep that under the function's max duration.
+OPENAI_BATCH_MIN_NAMES = int(os.getenv("OPENAI_BATCH_MIN_NAMES", "0"))
+OPENAI_BATCH_MAX_WAIT_SECONDS = float(os.getenv("OPENAI_BATCH_MAX_WAIT_SECONDS", "600"))
+
+# Recompute experiments.peptides inside Postgres
+# (fn_recompute_experiments_peptides) instead of diffing both tables here.
+USE_RPC_BACKFILL = os.getenv("USE_RPC_BACKFILL", "").lower() in ("1", "true", "yes")
+
+# Strict structured output: the API guarantees this shape, so replies never
+# need fence-stripping.
+EXTRACTION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "peptides",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "index": {"type": "integer"},
+                            "peptides": {"type": "array", "items": {"type": "string"}},
+                        },
+                        "required": ["index", "peptides"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["results"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+# httpx pools are bound to the loop they were created on; reusing one from
+# another loop (e.g. repeated asyncio.run() in scripts) fails with
+# APIConnectionError, so each running loop gets its own client.
+_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI] = (
+    weakref.WeakKeyDictionary()
+)
+
+# In-process copy of peptide_name_cache (name hash -> peptides); warm
+# instances skip even the cache-table round-trip for names already seen.
+_EXTRACTION_CACHE: dict[str, list[str]] = {}
 
 
 def _get_client() -> AsyncOpenAI:
-    global _client
-    if _client is None:
-        _client = AsyncOpenAI(
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        # HTTP/2 multiplexes the 50-way extraction fan-out (possibly from
+        # overlapping cron calls) over a few keep-alive connections instead of
+        # one TLS handshake per request. Retries back off on 429s per request
+        # rather than failing the whole batch.
+        client = AsyncOpenAI(
             api_key=os.environ.get("OPENAI_API_KEY", ""),
+            max_retries=5,
+            http_client=httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=100,
+                    max_keepalive_connections=50,
+                    keepalive_expiry=60,
+                ),
+                timeout=httpx.Timeout(connect=5, read=60, write=30, pool=60),
+            ),
         )
-    return _client
+        _clients[loop] = client
+    return client
 
 
-async def extract_peptides_from_name(experiment_name: str) -> list[str]:
-    """Extract peptide identifiers from an experiment name using OpenAI."""
-    client = _get_client()
+async def close_openai_client() -> None:
+    """Close the current loop's OpenAI client connection pool (app shutdown)."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
 
-    response = await client.chat.completions.create(
-        model="gpt-5.2",
-        max_completion_tokens=256,
-        temperature=0,
-        messages=[
+
+def _extraction_request(experiment_names: list[str]) -> dict:
+    """Chat-completions body for one batch of names (live calls and Batch API)."""
+    numbered = "\n".join(
+        f"{index}. {name}" for index, name in enumerate(experiment_names, start=1)
+    )
+    return {
+        "model": "gpt-5.2",
+        "max_completion_tokens": 256 * len(experiment_names),
+        "temperature": 0,
+        "response_format": EXTRACTION_RESPONSE_FORMAT,
+        "messages": [
             {
                 "role": "user",
-                "content": f"{EXTRACTION_PROMPT}\n\nExperiment name: {experiment_name}",
+                "content": f"{EXTRACTION_PROMPT}\n\nExperiment names:\n{numbered}",
             }
         ],
+    }
+
+
+def _parse_extraction(text: str, count: int) -> list[list[str] | None]:
+    extracted: list[list[str] | None] = [None for _ in range(count)]
+    try:
+        results = orjson.loads(text)["results"]
+    except (orjson.JSONDecodeError, KeyError, TypeError):
+        # Only reachable on refusals or replies cut off by max_completion_tokens.
+        return extracted
+
+    for entry in results:
+        position = entry["index"] - 1
+        if 0 <= position < count:
+            extracted[position] = [
+                p for p in entry["peptides"] if isinstance(p, str) and p.strip()
+            ]
+    return extracted
+
+
+async def extract_peptides_from_names(
+    experiment_names: list[str],
+) -> list[list[str] | None]:
+    """Extract peptide identifiers for several experiment names in one OpenAI call.
+
+    Returns one list per input name, in input order; None marks a name the
+    model gave no usable answer for, so callers can avoid caching it.
+    """
+    client = _get_client()
+    response = await client.chat.completions.create(
+        **_extraction_request(experiment_names)
     )
+    text = response.choices[0].message.content or ""
+    return _parse_extraction(text, len(experiment_names))
+
 
-    text = (response.choices[0].message.content or "").strip()
-    text = re.sub(r"^```(?:json)?\s*", "", text)
-    text = re.sub(r"\s*```$", "", text)
+async def _extract_via_batch_api(
+    experiment_names: list[str],
+) -> dict[str, list[str]] | None:
+    """Run extraction through the OpenAI Batch API (half the token price).
+
+    Returns None when the batch doesn't finish within
+    OPENAI_BATCH_MAX_WAIT_SECONDS, so the caller can fall back to live calls.
+    """
+    client = _get_client()
+    batches = [
+        experiment_names[start:start + EXTRACTION_BATCH_SIZE]
+        for start in range(0, len(experiment_names), EXTRACTION_BATCH_SIZE)
+    ]
+    lines = [
+        orjson.dumps({
+            "custom_id": str(index),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": _extraction_request(batch),
+        })
+        for index, batch in enumerate(batches)
+    ]
 
     try:
-        result = json.loads(text)
-        if isinstance(result, list):
-            return [str(p) for p in result if isinstance(p, str) and p.strip()]
-    except json.JSONDecodeError:
-        pass
+        input_file = await client.files.create(
+            file=("peptide_extraction.jsonl", b"\n".join(lines)),
+            purpose="batch",
+        )
+        batch_job = await client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
 
-    return []
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + OPENAI_BATCH_MAX_WAIT_SECONDS
+        delay = 5.0
+        while batch_job.status not in ("completed", "failed", "expired", "cancelled"):
+            if loop.time() + delay > deadline:
+                await client.batches.cancel(batch_job.id)
+                return None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60.0)
+            batch_job = await client.batches.retrieve(batch_job.id)
+
+        if batch_job.status != "completed" or not batch_job.output_file_id:
+            return None
+        output = await client.files.content(batch_job.output_file_id)
+    except Exception:
+        return None
+
+    extracted: dict[str, list[str]] = {}
+    for line in output.text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            record = orjson.loads(line)
+            batch = batches[int(record["custom_id"])]
+            response = record.get("response") or {}
+            if response.get("status_code") != 200:
+                continue
+            text = response["body"]["choices"][0]["message"]["content"] or ""
+        except (ValueError, KeyError, IndexError, TypeError):
+            continue
+        for name, peptides in zip(batch, _parse_extraction(text, len(batch))):
+            if peptides is not None:
+                extracted[name] = peptides
+    return extracted
+
+
+async def extract_peptides_from_name(experiment_name: str) -> list[str]:
+    """Extract peptide identifiers from an experiment name using OpenAI."""
+    return (await extract_peptides_from_names([experiment_name]))[0] or []
+
+
+def _fast_extract(experiment_name: str) -> list[str] | None:
+    """Extract peptides without OpenAI, or None when the name needs the model."""
+    peptides: list[str] = []
+    for part in experiment_name.split("+"):
+        part = part.strip()
+        if part.lower() in _NON_PEPTIDE_TOKENS:
+            continue
+        match = _FAST_PEPTIDE_RE.fullmatch(part)
+        if not match:
+            return None
+        base, version = match["base"], match["ver"]
+        if base == "TAK":
+            peptide = "TAK861"
+        elif version:
+            peptide = f"{_FAST_BASE_ALIASES.get(base, base)}v{version}"
+        else:
+            return None
+        if peptide not in peptides:
+            peptides.append(peptide)
+    return peptides
+
+
+def _extraction_key(experiment_name: object) -> str:
+    return " ".join(str(experiment_name or "").split())
+
+
+def _name_hash(experiment_name: str) -> str:
+    key = f"{EXTRACTION_PROMPT_VERSION}\x00{experiment_name}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+async def _load_cached_extractions(
+    supabase,
+    experiment_names: list[str],
+) -> dict[str, list[str]]:
+    """Look experiment names up in the in-process cache, then peptide_name_cache."""
+    found: dict[str, list[str]] = {}
+    names_by_hash: dict[str, str] = {}
+    for name in experiment_names:
+        name_hash = _name_hash(name)
+        if name_hash in _EXTRACTION_CACHE:
+            found[name] = _EXTRACTION_CACHE[name_hash]
+        else:
+            names_by_hash[name_hash] = name
+
+    hashes = list(names_by_hash)
+    try:
+        results = await asyncio.gather(*(
+            asyncio.to_thread(
+                supabase.table("peptide_name_cache")
+                .select("name_hash, peptides")
+                .in_("name_hash", hashes[start:start + NAME_FILTER_CHUNK_SIZE])
+                .execute
+            )
+            for start in range(0, len(hashes), NAME_FILTER_CHUNK_SIZE)
+        ))
+    except Exception:
+        # A missing or unreachable cache only costs extra OpenAI calls.
+        return found
+
+    for result in results:
+        for row in result.data or []:
+            peptides = list(row.get("peptides") or [])
+            _EXTRACTION_CACHE[row["name_hash"]] = peptides
+            found[names_by_hash[row["name_hash"]]] = peptides
+    return found
+
+
+async def _store_extractions(supabase, extracted: dict[str, list[str]]) -> None:
+    if not extracted:
+        return
+    rows = [
+        {"name_hash": _name_hash(name), "peptides": peptides}
+        for name, peptides in extracted.items()
+    ]
+    for row in rows:
+        _EXTRACTION_CACHE[row["name_hash"]] = row["peptides"]
+    try:
+        await asyncio.to_thread(
+            supabase.table("peptide_name_cache")
+            .upsert(rows, on_conflict="name_hash")
+            .execute
+        )
+    except Exception:
+        # Caching is best-effort; the next run just re-extracts these names.
+        pass
 
 
-def _normalize_peptide_names(value: object) -> list[str]:
-    """Normalize peptide arrays for deterministic comparison and storage."""
+def _peptide_set(value: object) -> frozenset[str]:
+    """Unique, stripped peptide names from a peptides array, for comparison."""
     if not isinstance(value, list):
-        return []
-    unique = {item.strip() for item in value if isinstance(item, str) and item.strip()}
-    return sorted(unique, key=str.lower)
+        return frozenset()
+    return frozenset(
+        item.strip() for item in value if isinstance(item, str) and item.strip()
+    )
 
 
 def _normalize_experiment_links(value: object) -> list[dict[str, str]]:
@@ -106,33 +395,41 @@ def _normalize_experiment_links(value: object) -> list[dict[str, str]]:
     return normalized
 
 
+def _link_pairs(links: list[dict[str, str]]) -> set[tuple[str, str]]:
+    return {(name, exp_id) for entry in links for name, exp_id in entry.items()}
+
+
 def _extract_experiment_ids_from_links(value: object) -> set[str]:
+    # Walks the raw links directly; building the normalized [{name: id}]
+    # records just to read their ids back allocates per entry in a hot loop.
+    if not isinstance(value, list):
+        return set()
     ids: set[str] = set()
-    for entry in _normalize_experiment_links(value):
-        ids.update(entry.values())
+    for entry in value:
+        if not isinstance(entry, dict):
+            continue
+        for exp_id_raw in entry.values():
+            exp_id = str(exp_id_raw or "").strip()
+            if exp_id:
+                ids.add(exp_id)
     return ids
 
 
 async def _run_experiment_peptides_backfill(
     experiment_ids: list[str] | None = None,
+    experiment_rows: list[dict] | None = None,
 ) -> dict[str, int | bool | str]:
-    """Recompute experiments.peptides from peptide.experiments links."""
-    supabase = get_supabase_admin()
-
-    peptides_result = (
-        supabase.table("peptides")
-        .select("name, experiments")
-        .execute()
-    )
-    peptide_rows = peptides_result.data or []
+    """Recompute experiments.peptides from peptide.experiments links.
 
+    Callers that already hold the target experiments' id/peptides rows can
+    pass them as experiment_rows to skip re-reading them.
+    """
     target_ids = (
         sorted({str(exp_id).strip() for exp_id in (experiment_ids or []) if str(exp_id).strip()})
         if experiment_ids is not None
         else None
     )
 
-    experiments_query = supabase.table("experiments").select("id, peptides")
     if target_ids is not None:
         if not target_ids:
             return {
@@ -141,15 +438,35 @@ async def _run_experiment_peptides_backfill(
                 "unchanged_experiments": 0,
                 "cleared_experiments": 0,
                 "total_experiments": 0,
-                "total_peptides": len(peptide_rows),
+                "total_peptides": 0,
                 "unresolved_links": 0,
                 "targeted": True,
+                "skipped_fetch": True,
                 "message": "No target experiment IDs provided",
             }
-        experiments_query = experiments_query.in_("id", target_ids)
 
-    experiments_result = experiments_query.execute()
-    experiment_rows = experiments_result.data or []
+    supabase = get_supabase_admin()
+
+    if USE_RPC_BACKFILL:
+        response = await asyncio.to_thread(
+            supabase.rpc(
+                "fn_recompute_experiments_peptides",
+                {"target_ids": target_ids},
+            ).execute
+        )
+        return {
+            "success": True,
+            **(response.data or {}),
+            "targeted": target_ids is not None,
+        }
+
+    if experiment_rows is None:
+        experiments_query = supabase.table("experiments").select("id, peptides")
+        if target_ids is not None:
+            experiments_query = experiments_query.in_("id", target_ids)
+        experiment_rows = (
+            await asyncio.to_thread(experiments_query.execute)
+        ).data or []
 
     if not experiment_rows:
         return {
@@ -158,7 +475,7 @@ async def _run_experiment_peptides_backfill(
             "unchanged_experiments": 0,
             "cleared_experiments": 0,
             "total_experiments": 0,
-            "total_peptides": len(peptide_rows),
+            "total_peptides": 0,
             "unresolved_links": 0,
             "targeted": target_ids is not None,
             "message": "No experiments found",
@@ -168,46 +485,85 @@ async def _run_experiment_peptides_backfill(
         str(row["id"]): set() for row in experiment_rows if row.get("id")
     }
     unresolved_links = 0
+    total_peptides = 0
+
+    # Page through peptides so memory is bounded by one page rather than the
+    # whole table (an unpaged select is also silently capped at max_rows).
+    offset = 0
+    while True:
+        peptide_rows = (
+            await asyncio.to_thread(
+                supabase.table("peptides")
+                .select("name, experiments")
+                .order("id")
+                .range(offset, offset + PEPTIDE_PAGE_SIZE - 1)
+                .execute
+            )
+        ).data or []
+        total_peptides += len(peptide_rows)
+
+        for peptide in peptide_rows:
+            peptide_name = str(peptide.get("name") or "").strip()
+            if not peptide_name:
+                continue
 
-    for peptide in peptide_rows:
-        peptide_name = str(peptide.get("name") or "").strip()
-        if not peptide_name:
-            continue
+            links = peptide.get("experiments")
+            for exp_id in _extract_experiment_ids_from_links(links):
+                if exp_id in peptides_by_experiment:
+                    peptides_by_experiment[exp_id].add(peptide_name)
+                elif target_ids is None:
+                    unresolved_links += 1
 
-        links = peptide.get("experiments")
-        for exp_id in _extract_experiment_ids_from_links(links):
-            if exp_id in peptides_by_experiment:
-                peptides_by_experiment[exp_id].add(peptide_name)
-            elif target_ids is None:
-                unresolved_links += 1
+        if len(peptide_rows) < PEPTIDE_PAGE_SIZE:
+            break
+        offset += PEPTIDE_PAGE_SIZE
 
-    updated_experiments = 0
     unchanged_experiments = 0
     cleared_experiments = 0
+    changed_rows: list[dict] = []
 
     for experiment in experiment_rows:
         exp_id = str(experiment["id"])
-        current = _normalize_peptide_names(experiment.get("peptides"))
-        expected = sorted(peptides_by_experiment.get(exp_id, set()), key=str.lower)
+        expected_set = peptides_by_experiment.get(exp_id, set())
 
-        if current == expected:
+        # Compare as sets first; only rows that actually change pay for a sort.
+        if _peptide_set(experiment.get("peptides")) == expected_set:
             unchanged_experiments += 1
             continue
 
-        supabase.table("experiments").update(
-            {"peptides": expected if expected else None}
-        ).eq("id", exp_id).execute()
-        updated_experiments += 1
+        # Exact name breaks case-only ties, matching the order
+        # fn_recompute_experiments_peptides writes (lower(name), name "C").
+        expected = sorted(expected_set, key=lambda name: (name.lower(), name))
+
+        changed_rows.append({"id": exp_id, "peptides": expected if expected else None})
         if not expected:
             cleared_experiments += 1
 
+    # One UPDATE per changed experiment, several in flight from worker
+    # threads. Not an upsert: experiment_rows may predate this run by
+    # minutes, and an experiment deleted since must not come back as an
+    # {id, peptides} row.
+    write_sem = asyncio.Semaphore(EXPERIMENT_WRITE_CONCURRENCY)
+
+    async def update_experiment(row: dict) -> None:
+        async with write_sem:
+            await asyncio.to_thread(
+                supabase.table("experiments")
+                .update({"peptides": row["peptides"]})
+                .eq("id", row["id"])
+                .execute
+            )
+
+    await asyncio.gather(*(update_experiment(row) for row in changed_rows))
+    updated_experiments = len(changed_rows)
+
     return {
         "success": True,
         "updated_experiments": updated_experiments,
         "unchanged_experiments": unchanged_experiments,
         "cleared_experiments": cleared_experiments,
         "total_experiments": len(experiment_rows),
-        "total_peptides": len(peptide_rows),
+        "total_peptides": total_peptides,
         "unresolved_links": unresolved_links,
         "targeted": target_ids is not None,
     }
@@ -215,9 +571,13 @@ async def _run_experiment_peptides_backfill(
 
 async def sync_experiment_peptides_for_experiment_ids(
     experiment_ids: list[str],
+    experiment_rows: list[dict] | None = None,
 ) -> dict[str, int | bool | str]:
     """Keep experiments.peptides in sync for a subset of experiment IDs."""
-    return await _run_experiment_peptides_backfill(experiment_ids=experiment_ids)
+    return await _run_experiment_peptides_backfill(
+        experiment_ids=experiment_ids,
+        experiment_rows=experiment_rows,
+    )
 
 
 async def run_backfill_experiment_peptides():
@@ -232,19 +592,20 @@ async def run_backfill_experiment_peptides():
 
 async def run_sync_peptides_cron(limit: int | None = None):
     """
-    Cron: call OpenAI to extract peptide identifiers from each experiment name
-    (50 parallel requests), then batch upsert results to the peptides table.
+    Cron: call OpenAI to extract peptide identifiers from experiment names
+    (batched, 50 parallel requests), then batch upsert results to the peptides table.
 
     If limit is set, only process the N most recently started experiments.
     """
     supabase = get_supabase_admin()
 
     # 1. Fetch experiments
-    query = supabase.table("experiments").select("id, name, experiment_start")
+    # peptides is selected too so the experiments.peptides sync at the end can
+    # reuse these rows instead of re-reading the same experiments.
+    query = supabase.table("experiments").select("id, name, experiment_start, peptides")
     if limit:
         query = query.order("experiment_start", desc=True).limit(limit)
-    experiments_result = query.execute()
-    experiments = experiments_result.data or []
+    experiments = (await asyncio.to_thread(query.execute)).data or []
 
     if not experiments:
         return {"success": True, "created": 0, "updated": 0, "message": "No experiments"}
@@ -255,17 +616,67 @@ async def run_sync_peptides_cron(limit: int | None = None):
         if exp.get("id")
     }
 
-    # 2. Extract peptides from each experiment name — 50 parallel requests
+    # 2. Extract peptides per unique experiment name. Cached names skip OpenAI;
+    # large runs can go through the Batch API, and everything else goes out
+    # EXTRACTION_BATCH_SIZE names per request — 50 parallel requests.
+    # Replicates and re-runs often share a name up to stray whitespace; key on
+    # the whitespace-collapsed name so each distinct name is extracted once.
+    # Case is kept since the prompt preserves peptide case (e.g. "aMCH").
+    unique_names = list({_extraction_key(exp["name"]) for exp in experiments} - {""})
+    extracted = await _load_cached_extractions(supabase, unique_names)
+    misses = [name for name in unique_names if name not in extracted]
+
+    # Names the pre-parser handles outright never reach OpenAI. They are
+    # cached like model answers, so later runs skip the regex pass too.
+    fast_hits = {name: _fast_extract(name) for name in misses}
+    fast_resolved = {
+        name: peptides for name, peptides in fast_hits.items() if peptides is not None
+    }
+    misses = [name for name in misses if fast_hits[name] is None]
+
+    fresh: dict[str, list[str]] = dict(fast_resolved)
+    if OPENAI_BATCH_MIN_NAMES and len(misses) >= OPENAI_BATCH_MIN_NAMES:
+        fresh.update(await _extract_via_batch_api(misses) or {})
+        misses = [name for name in misses if name not in fresh]
+
     sem = asyncio.Semaphore(50)
 
-    async def extract_with_limit(exp: dict) -> tuple[dict, list[str]]:
+    async def extract_with_limit(
+        batch: list[str],
+    ) -> list[tuple[str, list[str] | None]]:
         async with sem:
-            peptides = await extract_peptides_from_name(exp["name"])
-            return exp, peptides
-
-    results = await asyncio.gather(
-        *(extract_with_limit(exp) for exp in experiments)
+            peptides = await extract_peptides_from_names(batch)
+        if len(batch) > 1 and None in peptides:
+            # Retry names the batched reply didn't answer one at a time, so a
+            # single bad name can't sink the rest of its batch.
+            retried = iter(await asyncio.gather(*(
+                extract_with_limit([name])
+                for name, result in zip(batch, peptides)
+                if result is None
+            )))
+            peptides = [
+                next(retried)[0][1] if result is None else result
+                for result in peptides
+            ]
+        return list(zip(batch, peptides))
+
+    batches = await asyncio.gather(*(
+        extract_with_limit(misses[start:start + EXTRACTION_BATCH_SIZE])
+        for start in range(0, len(misses), EXTRACTION_BATCH_SIZE)
+    ))
+    fresh.update(
+        (name, peptides)
+        for batch in batches
+        for name, peptides in batch
+        if peptides is not None
     )
+    await _store_extractions(supabase, fresh)
+    extracted.update(fresh)
+
+    results = [
+        (exp, extracted.get(_extraction_key(exp["name"]), []))
+        for exp in experiments
+    ]
 
     # 3. Build peptide map (peptide_name -> {experiment_id: experiment_name})
     peptide_map: dict[str, dict[str, str]] = {}
@@ -280,13 +691,24 @@ async def run_sync_peptides_cron(limit: int | None = None):
                 continue
             peptide_map.setdefault(pep_name, {})[exp_id] = exp_name
 
-    # 4. Fetch existing peptides
-    existing_result = (
-        supabase.table("peptides")
-        .select("id, name, sequence, experiments")
-        .execute()
-    )
-    existing_by_name = {row["name"]: row for row in (existing_result.data or [])}
+    # 4. Fetch existing peptides — only the names extracted above, chunked so
+    # the in.() filter stays within URL length limits. Chunks are fetched
+    # concurrently in worker threads since the Supabase client is blocking.
+    pep_names = list(peptide_map)
+    existing_results = await asyncio.gather(*(
+        asyncio.to_thread(
+            supabase.table("peptides")
+            .select("id, name, experiments")
+            .in_("name", pep_names[start:start + NAME_FILTER_CHUNK_SIZE])
+            .execute
+        )
+        for start in range(0, len(pep_names), NAME_FILTER_CHUNK_SIZE)
+    ))
+    existing_by_name = {
+        row["name"]: row
+        for result in existing_results
+        for row in (result.data or [])
+    }
 
     # 5. Single batch push: insert new, update existing
     to_insert = []
@@ -299,19 +721,22 @@ async def run_sync_peptides_cron(limit: int | None = None):
         ]
         if pep_name in existing_by_name:
             row = existing_by_name[pep_name]
+            current_links = _normalize_experiment_links(row.get("experiments"))
             updated_links = exp_list
             if limit is not None:
                 # Partial sync should not erase links for experiments outside this run.
-                existing_links = _normalize_experiment_links(row.get("experiments"))
-                seen_ids = {exp_id for entry in exp_list for exp_id in entry.values()}
-                preserved_links = []
-                for entry in existing_links:
-                    exp_id = next(iter(entry.values()))
-                    if exp_id in processed_experiment_ids or exp_id in seen_ids:
-                        continue
-                    preserved_links.append(entry)
-                    seen_ids.add(exp_id)
+                # exp_list only holds processed ids and current_links is already
+                # de-duplicated by id, so filtering on processed ids suffices.
+                preserved_links = [
+                    entry
+                    for entry in current_links
+                    for exp_id in entry.values()
+                    if exp_id not in processed_experiment_ids
+                ]
                 updated_links = preserved_links + exp_list
+            if _link_pairs(current_links) == _link_pairs(updated_links):
+                # Idempotent re-run: skip the write when only order differs.
+                continue
             to_update.append({"id": row["id"], "experiments": updated_links})
         else:
             to_insert.append({
@@ -320,19 +745,46 @@ async def run_sync_peptides_cron(limit: int | None = None):
                 "experiments": exp_list,
             })
 
-    created_ids: list[int] = []
-    if to_insert:
-        insert_result = supabase.table("peptides").insert(to_insert).execute()
-        for row in insert_result.data or []:
-            try:
-                created_ids.append(int(row["id"]))
-            except Exception:
-                continue
+    # New and existing peptides are disjoint rows, so both writes go out
+    # together.
+    def insert_new() -> list[dict]:
+        if not to_insert:
+            return []
+        # A name created concurrently (e.g. via the API) must not fail the
+        # whole batch on peptides_name_key; such rows are skipped and not
+        # returned, so created counts only what was actually inserted.
+        return (
+            supabase.table("peptides")
+            .upsert(to_insert, on_conflict="name", ignore_duplicates=True)
+            .execute()
+            .data
+            or []
+        )
 
-    for row in to_update:
-        supabase.table("peptides").update(
-            {"experiments": row["experiments"]}
-        ).eq("id", row["id"]).execute()
+    # Existing peptides get UPDATEs, several in flight, rather than an upsert
+    # that would recreate a peptide deleted since it was read.
+    write_sem = asyncio.Semaphore(PEPTIDE_WRITE_CONCURRENCY)
+
+    async def update_existing(row: dict) -> None:
+        async with write_sem:
+            await asyncio.to_thread(
+                supabase.table("peptides")
+                .update({"experiments": row["experiments"]})
+                .eq("id", row["id"])
+                .execute
+            )
+
+    inserted_rows, *_ = await asyncio.gather(
+        asyncio.to_thread(insert_new),
+        *(update_existing(row) for row in to_update),
+    )
+
+    created_ids: list[int] = []
+    for row in inserted_rows:
+        try:
+            created_ids.append(int(row["id"]))
+        except Exception:
+            continue
 
     if created_ids:
         try:
@@ -343,12 +795,13 @@ async def run_sync_peptides_cron(limit: int | None = None):
 
     # Keep experiments.peptides synchronized for processed experiments.
     backfill_result = await sync_experiment_peptides_for_experiment_ids(
-        list(processed_experiment_ids)
+        list(processed_experiment_ids),
+        experiment_rows=[exp for exp in experiments if exp.get("id")],
     )
 
     return {
         "success": True,
-        "created": len(to_insert),
+        "created": len(inserted_rows),
         "updated": len(to_update),
         "total_peptides": len(peptide_map),
         "updated_experiments": backfill_result.get("updated_experiments", 0),
@@ -0,0 +1,20 @@
+def _to_positive_int(value: object) -> int | None:
+    try:
+        number = int(value)
+    except Exception:
+        return None
+    return number if number > 0 else None
+
+
+def normalize_target_ids(peptide_ids: list[int] | None) -> list[int] | None:
+    """Dedupe peptide IDs, dropping anything that isn't a positive int.
+
+    Order is not preserved; the result only feeds .in_() filters.
+    """
+    if peptide_ids is None:
+        return None
+    return list({
+        number
+        for number in map(_to_positive_int, peptide_ids)
+        if number is not None
+    })
@@ -14,12 +14,21 @@ CODEX_SECRET_NAME = os.getenv("MODAL_CODEX_SECRET", "codex-api-key")
 DATA_LAKE_VOLUME_NAME = os.getenv("DATA_LAKE_VOLUME_NAME", "capable-data-lake")
 CODEX_MODEL = os.getenv("CODEX_MODEL", "gpt-5.2-codex")
 CODEX_REASONING_EFFORT = os.getenv("CODEX_REASONING_EFFORT", "high")
+CODEX_MAX_CONTAINERS = int(os.getenv("MODAL_CODEX_MAX_CONTAINERS", "50"))
+
+SEQUENCE_TAG_RE = re.compile(r"<sequence>(.*?)</sequence>", re.DOTALL | re.IGNORECASE)
+WHITESPACE_RE = re.compile(r"\s+")
 
 DATA_LAKE_VOLUME = modal.Volume.from_name(
     DATA_LAKE_VOLUME_NAME,
     create_if_missing=True,
 )
 
+WORKSPACE = Path("/repo")
+if not modal.is_local():
+    # Once per container rather than once per call.
+    WORKSPACE.mkdir(parents=True, exist_ok=True)
+
 app = modal.App(APP_NAME)
 
 image = (
@@ -79,21 +88,60 @@ If unknown:
 
 
 def parse_sequence_tag(text: str) -> str:
-    match = re.search(r"<sequence>(.*?)</sequence>", text, flags=re.DOTALL | re.IGNORECASE)
+    match = SEQUENCE_TAG_RE.search(text)
     if not match:
         return ""
     sequence = match.group(1).strip()
-    return re.sub(r"\s+", "", sequence)
+    return WHITESPACE_RE.sub("", sequence)
 
 
 def extract_sequence_explanation(text: str) -> str:
-    explanation = re.sub(
-        r"<sequence>.*?</sequence>",
-        "",
-        text,
-        flags=re.DOTALL | re.IGNORECASE,
-    )
-    return explanation.strip()
+    return SEQUENCE_TAG_RE.sub("", text).strip()
+
+
+def run_codex(prompt: str, stop_marker: str | None = None) -> tuple[int, str, str]:
+    """Run `codex exec` on prompt and return (returncode, stdout, stderr).
+
+    stdout is read as it streams; once a line contains stop_marker the answer
+    is complete, so codex is terminated instead of waiting for it to exit.
+    stderr goes to a temp file so an unread pipe can never block the child.
+    """
+    with tempfile.TemporaryFile(mode="w+", dir="/tmp") as stderr_file:
+        with subprocess.Popen(
+            [
+                "codex",
+                "exec",
+                "--yolo",
+                "-m",
+                CODEX_MODEL,
+                "-c",
+                f"model_reasoning_effort={json.dumps(CODEX_REASONING_EFFORT)}",
+                "-",
+            ],
+            cwd=str(WORKSPACE),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=stderr_file,
+            text=True,
+        ) as process:
+            try:
+                process.stdin.write(prompt)
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+            lines: list[str] = []
+            stopped = False
+            for line in process.stdout:
+                lines.append(line)
+                if stop_marker and stop_marker in line:
+                    stopped = True
+                    process.terminate()
+                    break
+            returncode = process.wait()
+
+        stderr_file.seek(0)
+        return 0 if stopped else returncode, "".join(lines), stderr_file.read()
 
 
 def build_notes_prompt(peptide_name: str, notes_path: str) -> str:
@@ -113,12 +161,11 @@ Do not print the markdown itself to stdout. Write markdown only to the file path
     image=image,
     secrets=[modal.Secret.from_name(CODEX_SECRET_NAME)],
     volumes={"/repo/datalake": DATA_LAKE_VOLUME.read_only()},
+    max_containers=CODEX_MAX_CONTAINERS,
 )
 def run_codex_for_peptide(job: dict[str, object]) -> dict[str, object]:
     peptide_id = int(job["peptide_id"])
     peptide_name = str(job["name"] or "").strip()
-    workspace = Path("/repo")
-    workspace.mkdir(parents=True, exist_ok=True)
 
     if not peptide_name:
         return {
@@ -129,31 +176,15 @@ def run_codex_for_peptide(job: dict[str, object]) -> dict[str, object]:
         }
 
     prompt = build_prompt(peptide_name)
-    result = subprocess.run(
-        [
-            "codex",
-            "exec",
-            "--yolo",
-            "-m",
-            CODEX_MODEL,
-            "-c",
-            f"model_reasoning_effort={json.dumps(CODEX_REASONING_EFFORT)}",
-            "-",
-        ],
-        cwd=str(workspace),
-        capture_output=True,
-        text=True,
-        input=prompt,
-        check=False,
-    )
-    raw_output = (result.stdout or "").strip()
+    returncode, stdout, stderr = run_codex(prompt, stop_marker="</sequence>")
+    raw_output = stdout.strip()
     explanation = extract_sequence_explanation(raw_output)
-    if result.returncode != 0:
+    if returncode != 0:
         return {
             "peptide_id": peptide_id,
             "sequence": "",
             "status": "failed",
-            "error": (result.stderr or "codex exec failed").strip(),
+            "error": (stderr or "codex exec failed").strip(),
             "raw_output": raw_output,
             "decision_notes": explanation,
         }
@@ -172,12 +203,11 @@ def run_codex_for_peptide(job: dict[str, object]) -> dict[str, object]:
     image=image,
     secrets=[modal.Secret.from_name(CODEX_SECRET_NAME)],
     volumes={"/repo/datalake": DATA_LAKE_VOLUME.read_only()},
+    max_containers=CODEX_MAX_CONTAINERS,
 )
 def run_codex_for_peptide_notes(job: dict[str, object]) -> dict[str, object]:
     peptide_id = int(job["peptide_id"])
     peptide_name = str(job["name"] or "").strip()
-    workspace = Path("/repo")
-    workspace.mkdir(parents=True, exist_ok=True)
 
     if not peptide_name:
         return {
@@ -197,33 +227,17 @@ def run_codex_for_peptide_notes(job: dict[str, object]) -> dict[str, object]:
         ) as temp_dir:
             notes_file_path = Path(temp_dir) / "notes.md"
             prompt = build_notes_prompt(peptide_name, str(notes_file_path))
-            result = subprocess.run(
-                [
-                    "codex",
-                    "exec",
-                    "--yolo",
-                    "-m",
-                    CODEX_MODEL,
-                    "-c",
-                    f"model_reasoning_effort={json.dumps(CODEX_REASONING_EFFORT)}",
-                    "-",
-                ],
-                cwd=str(workspace),
-                capture_output=True,
-                text=True,
-                input=prompt,
-                check=False,
-            )
-            if result.returncode != 0:
+            returncode, stdout, stderr = run_codex(prompt)
+            if returncode != 0:
                 return {
                     "peptide_id": peptide_id,
                     "notes": "",
                     "status": "failed",
-                    "error": (result.stderr or "codex exec failed").strip(),
-                    "raw_output": (result.stdout or "").strip(),
+                    "error": (stderr or "codex exec failed").strip(),
+                    "raw_output": stdout.strip(),
                 }
 
-            raw_output = (result.stdout or "").strip()
+            raw_output = stdout.strip()
             if notes_file_path.exists():
                 notes = notes_file_path.read_text(encoding="utf-8").strip()
     except Exception as exc:
@@ -248,3 +262,20 @@ def main(peptide_id: int, peptide_name: str) -> None:
         {"peptide_id": peptide_id, "name": peptide_name}
     )
     print(json.dumps(result, indent=2))
+
+
+@app.local_entrypoint()
+def run_many(peptide_jobs_json: str) -> None:
+    """Run a JSON list of {"peptide_id", "name"} jobs in parallel containers."""
+    jobs = json.loads(peptide_jobs_json)
+    results = [
+        result
+        if not isinstance(result, BaseException)
+        else {"status": "failed", "error": f"Modal call failed: {result}"}
+        for result in run_codex_for_peptide.map(
+            jobs,
+            order_outputs=False,
+            return_exceptions=True,
+        )
+    ]
+    print(json.dumps(results, indent=2))
@@ -1,10 +1,12 @@
 from __future__ import annotations
 
 import argparse
-import csv
 import json
 from pathlib import Path
 
+import orjson
+import pandas as pd
+
 
 DEFAULT_INPUT = Path("outputs/nps_truncation_results.csv")
 DEFAULT_OUTPUT = Path("outputs/n_results_peptides.csv")
@@ -12,6 +14,30 @@ DEFAULT_COLUMN = "parsed_peptides"
 DEFAULT_N_RESULTS_COLUMN = "n_results"
 
 
+def _has_float(values: object) -> bool:
+    if isinstance(values, list):
+        return any(isinstance(item, float) for item in values)
+    return isinstance(values, float)
+
+
+def parse_peptides(raw: str) -> list[str]:
+    try:
+        values = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        values = None
+    # orjson rejects NaN/Infinity and reads integers wider than 64 bits as
+    # floats; json accepts both and keeps big integers exact, so those (rare)
+    # cells are re-parsed with it before being treated as invalid.
+    if values is None or _has_float(values):
+        try:
+            values = json.loads(raw)
+        except json.JSONDecodeError:
+            return []
+    if not isinstance(values, list):
+        values = [values]
+    return [str(item) for item in values]
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(
         description="Extract unique peptide sequences from a CSV column."
@@ -25,54 +51,44 @@ def main() -> None:
     if not args.input.exists():
         raise SystemExit(f"Missing input CSV: {args.input}")
 
-    with args.input.open(newline="", encoding="utf-8") as handle:
-        reader = csv.DictReader(handle)
-        if not reader.fieldnames:
-            raise SystemExit(f"Missing header in {args.input}")
-        if args.column not in reader.fieldnames:
-            raise SystemExit(f"Missing column '{args.column}' in {args.input}")
-        if args.n_results_column not in reader.fieldnames:
-            raise SystemExit(
-                f"Missing column '{args.n_results_column}' in {args.input}"
-            )
-
-        rows_written = 0
-
-        args.output.parent.mkdir(parents=True, exist_ok=True)
-        with args.output.open("w", encoding="utf-8", newline="") as out_handle:
-            writer = csv.writer(out_handle)
-            writer.writerow(["peptide", "n_results"])
-
-            for row in reader:
-                raw = (row.get(args.column) or "").strip()
-                if not raw:
-                    continue
-                n_results_raw = (row.get(args.n_results_column) or "").strip()
-                if not n_results_raw:
-                    continue
-                try:
-                    n_results = int(float(n_results_raw))
-                except ValueError:
-                    continue
-
-                try:
-                    values = json.loads(raw)
-                except json.JSONDecodeError:
-                    continue
-
-                if isinstance(values, list):
-                    for value in values:
-                        value = str(value).strip()
-                        if value:
-                            writer.writerow([value, n_results])
-                            rows_written += 1
-                else:
-                    value = str(values).strip()
-                    if value:
-                        writer.writerow([value, n_results])
-                        rows_written += 1
-
-    print(f"Wrote {rows_written} peptide/n_results rows to {args.output}")
+    try:
+        columns = pd.read_csv(args.input, nrows=0, encoding="utf-8").columns
+    except pd.errors.EmptyDataError:
+        raise SystemExit(f"Missing header in {args.input}")
+    if args.column not in columns:
+        raise SystemExit(f"Missing column '{args.column}' in {args.input}")
+    if args.n_results_column not in columns:
+        raise SystemExit(
+            f"Missing column '{args.n_results_column}' in {args.input}"
+        )
+
+    # Only the two needed columns, kept as raw strings (no NA inference).
+    df = pd.read_csv(
+        args.input,
+        usecols=[args.column, args.n_results_column],
+        dtype=str,
+        keep_default_na=False,
+        encoding="utf-8",
+    )
+    raw = df[args.column].str.strip()
+    n_results = pd.to_numeric(df[args.n_results_column].str.strip(), errors="coerce")
+    keep = (raw != "") & n_results.notna() & ~n_results.isin([float("inf"), float("-inf")])
+
+    out = pd.DataFrame(
+        {
+            "peptide": raw[keep].map(parse_peptides),
+            "n_results": n_results[keep].astype(int),
+        }
+    ).explode("peptide", ignore_index=True)
+    # Empty lists explode to NaN; strip and drop blanks in one vectorized pass.
+    out = out.dropna(subset=["peptide"])
+    out["peptide"] = out["peptide"].str.strip()
+    out = out[out["peptide"] != ""]
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    out.to_csv(args.output, index=False, encoding="utf-8", lineterminator="\r\n")
+
+    print(f"Wrote {len(out)} peptide/n_results rows to {args.output}")
 
 
 if __name__ == "__main__":
@@ -1,14 +1,19 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
 import csv
+import functools
+import hashlib
 import io
+import itertools
 import json
 import os
 import re
 import subprocess
-from collections import Counter
+from collections import Counter, defaultdict
 from pathlib import Path
+from typing import Iterator
 
 import modal
 
@@ -29,18 +34,40 @@ DEFAULT_REPORT_PATH = Path(
     os.getenv("REPORT_PATH", "outputs/nps_mastersheet_normalize_report.json")
 )
 DEFAULT_MAX_PARALLEL = int(os.getenv("MAX_PARALLEL", "100"))
+# Compounds per Codex invocation; the rules and peptides.html are shared, so
+# batching pays the process start and model round-trip once per batch.
+CODEX_BATCH_SIZE = max(1, int(os.getenv("CODEX_BATCH", "10")))
 DEFAULT_MAX_TOTAL = int(os.getenv("MAX_TOTAL", "1000"))
 RAW_VOLUME_NAME = os.getenv("RAW_VOLUME_NAME", "capable-exp-raw")
 RAW_VOLUME = modal.Volume.from_name(RAW_VOLUME_NAME, create_if_missing=True)
+PEPTIDES_HTML_HASH_PATH = "/peptides.html.sha256"
+# Passed to codex exec -m when set; empty keeps codex's own default model.
+CODEX_MODEL = os.getenv("CODEX_MODEL", "")
+# Part of every cache key; bump when the prompt or how its output is parsed
+# changes, so earlier results are not served for the new version.
+PROMPT_VERSION = "1"
+# Codex results keyed by prompt hash. A named Dict rather than a local
+# directory, since run_codex containers (and their disks) are ephemeral.
+# Set CODEX_CACHE="" to disable.
+CODEX_CACHE_NAME = os.getenv("CODEX_CACHE", "capable-codex-cache")
+CODEX_CACHE = (
+    modal.Dict.from_name(CODEX_CACHE_NAME, create_if_missing=True)
+    if CODEX_CACHE_NAME
+    else None
+)
+CACHE_LOOKUP_CONCURRENCY = 64
+
+RANGE_SUFFIX_RE = re.compile(r"\(\s*\d+\s*[-–]\s*\d+\s*\)")
+PARENTHETICAL_RE = re.compile(r"\([^)]*\)")
 
 
-def build_prompt(payload_json: str) -> str:
+def build_prompt(payloads_json: str) -> str:
     return f"""You are in /repo and can read /repo/raw/peptides.html.
 
-You are given one compound payload as JSON:
-{payload_json}
+You are given a JSON array of compound payloads:
+{payloads_json}
 
-Task:
+Task, for each payload:
 1) If full_sequence is present in the payload, normalize it to match the rules below.
 2) If full_sequence is empty, fill it using information in /repo/raw/peptides.html.
 
@@ -69,19 +96,76 @@ Normalization guidance (apply these mappings when seen):
 - N-Me-L-Lys -> N-Me-Lys
 
 Filling missing full_sequence:
-- Only use information present in /repo/raw/peptides.html or in this payload.
+- Only use information present in /repo/raw/peptides.html or in that payload.
 - Do not invent sequences.
 - Match by compound/name. Use reasonable normalization (case-insensitive, ignore punctuation, ignore unicode subscripts).
 - For names like hNPS(1-10) or similar ranges, use the base sequence from peptides.html and slice the indicated range.
 - If existing_full_sequences are provided, prefer the most frequent sequence and normalize it
 
-Return ONLY JSON with keys:
+Return ONLY a JSON array with one object per payload, each with keys:
+- canonical_compound (copied exactly from the payload)
 - full_sequence (string, empty if still missing)
 - status (one of: "normalized", "filled", "missing", "unchanged")
 - reason (short string)
 """
 
 
+@functools.lru_cache(maxsize=None)
+def canonicalize_compound(name: str) -> str:
+    raw = (name or "").strip()
+    if not raw:
+        return raw
+    upper = raw.upper()
+    if "NPS" in upper:
+        token = raw.split()[0]
+        # Keep range suffixes like (1-10) but drop non-range parentheticals.
+        if "(" in token and ")" in token:
+            if not RANGE_SUFFIX_RE.search(token):
+                token = PARENTHETICAL_RE.sub("", token)
+        return token
+    return raw
+
+
+def cache_key(*parts: str) -> str:
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+def cache_get_many(keys: list[str]) -> list[object | None]:
+    """Look keys up concurrently (the Dict has no bulk get); misses are None."""
+    if CODEX_CACHE is None or not keys:
+        return [None] * len(keys)
+    sem = asyncio.Semaphore(CACHE_LOOKUP_CONCURRENCY)
+
+    async def lookup(key: str) -> object | None:
+        async with sem:
+            try:
+                return await CODEX_CACHE.get.aio(key)
+            except Exception:
+                return None
+
+    async def lookup_all() -> list[object | None]:
+        return await asyncio.gather(*(lookup(key) for key in keys))
+
+    try:
+        return asyncio.run(lookup_all())
+    except Exception:
+        return [None] * len(keys)
+
+
+def codex_command(model: str) -> list[str]:
+    model_args = ["-m", model] if model else []
+    return ["codex", "exec", "--yolo", *model_args, "-"]
+
+
+def cache_put(entries: dict[str, object]) -> None:
+    if CODEX_CACHE is None or not entries:
+        return
+    try:
+        CODEX_CACHE.update(entries)
+    except Exception:
+        pass
+
+
 app = modal.App(APP_NAME)
 
 image = (
@@ -97,19 +181,24 @@ image = (
     image=image,
     secrets=[modal.Secret.from_name(CODEX_SECRET_NAME)],
     volumes={"/repo/raw": RAW_VOLUME.read_only()},
+    max_containers=DEFAULT_MAX_PARALLEL,
 )
-def run_codex(job: dict[str, object]) -> dict[str, object]:
+def run_codex(
+    batch: list[dict[str, object]],
+    model: str = CODEX_MODEL,
+) -> list[dict[str, object]]:
     workspace = Path("/repo")
     workspace.mkdir(parents=True, exist_ok=True)
 
-    payload = job["payload"]
-    payload_json = json.dumps(payload, ensure_ascii=False)
-    prompt = build_prompt(payload_json)
+    payloads = [job["payload"] for job in batch]
+    payloads_json = json.dumps(payloads, ensure_ascii=False)
+    prompt = build_prompt(payloads_json)
     result = subprocess.run(
-        ["codex", "exec", "--yolo", "-"],
+        codex_command(model),
         cwd=str(workspace),
         capture_output=True,
-        text=True,
+        encoding="utf-8",
+        errors="replace",
         input=prompt,
         check=False,
     )
@@ -120,23 +209,31 @@ def run_codex(job: dict[str, object]) -> dict[str, object]:
     try:
         response = json.loads(raw_output)
     except json.JSONDecodeError:
-        start = raw_output.find("{")
-        end = raw_output.rfind("}")
+        start = raw_output.find("[")
+        end = raw_output.rfind("]")
         if start == -1 or end == -1 or end <= start:
             raise RuntimeError(f"codex output was not JSON: {raw_output}")
         response = json.loads(raw_output[start : end + 1])
-
-    full_sequence = str(response.get("full_sequence", "") or "")
-    status = str(response.get("status", "") or "")
-    reason = str(response.get("reason", "") or "")
-
-    return {
-        "key": str(job["key"]),
-        "full_sequence": full_sequence,
-        "status": status,
-        "reason": reason,
-        "raw_output": raw_output,
-    }
+    if isinstance(response, dict):
+        response = [response]
+
+    keys = {str(job["key"]) for job in batch}
+    results = []
+    for item in response:
+        if not isinstance(item, dict):
+            continue
+        key = str(item.get("canonical_compound", "") or "")
+        if key not in keys:
+            continue
+        results.append(
+            {
+                "key": key,
+                "full_sequence": str(item.get("full_sequence", "") or ""),
+                "status": str(item.get("status", "") or ""),
+                "reason": str(item.get("reason", "") or ""),
+            }
+        )
+    return results
 
 
 @app.local_entrypoint()
@@ -152,67 +249,59 @@ def main() -> None:
     parser.add_argument("--max-total", type=int, default=DEFAULT_MAX_TOTAL)
     args, _ = parser.parse_known_args()
 
+    # Skip the upload when the volume already holds this exact peptides.html.
+    peptides_html_hash = hashlib.sha256(args.peptides_html.read_bytes()).hexdigest()
     try:
-        RAW_VOLUME.remove_file("/peptides.html", recursive=True)
+        uploaded_hash = b"".join(RAW_VOLUME.read_file(PEPTIDES_HTML_HASH_PATH)).decode()
     except Exception:
-        pass
-    with RAW_VOLUME.batch_upload(force=True) as batch:
-        batch.put_file(str(args.peptides_html), "/peptides.html")
-
-    csv_text = args.input_csv.read_text(encoding="utf-8")
-    all_rows = list(csv.DictReader(io.StringIO(csv_text)))
-    fieldnames = list(all_rows[0].keys()) if all_rows else []
-    rows = all_rows
-    if args.max_total and args.max_total > 0:
-        rows = all_rows[: args.max_total]
-
-    def canonicalize_compound(name: str) -> str:
-        raw = (name or "").strip()
-        if not raw:
-            return raw
-        upper = raw.upper()
-        if "NPS" in upper:
-            token = raw.split()[0]
-            # Keep range suffixes like (1-10) but drop non-range parentheticals.
-            if "(" in token and ")" in token:
-                if not re.search(r"\(\s*\d+\s*[-–]\s*\d+\s*\)", token):
-                    token = re.sub(r"\([^)]*\)", "", token)
-            return token
-        return raw
-
-    grouped: dict[str, dict[str, object]] = {}
+        uploaded_hash = ""
+    if uploaded_hash.strip() != peptides_html_hash:
+        try:
+            RAW_VOLUME.remove_file("/peptides.html", recursive=True)
+        except Exception:
+            pass
+        with RAW_VOLUME.batch_upload(force=True) as batch:
+            batch.put_file(str(args.peptides_html), "/peptides.html")
+            batch.put_file(
+                io.BytesIO(peptides_html_hash.encode("utf-8")),
+                PEPTIDES_HTML_HASH_PATH,
+            )
+
+    # Stream the sheet: keep only the first max_total rows and just count the rest.
+    max_rows = args.max_total if args.max_total and args.max_total > 0 else None
+    with args.input_csv.open(encoding="utf-8", newline="") as handle:
+        reader = csv.DictReader(handle)
+        fieldnames = list(reader.fieldnames or [])
+        rows = list(itertools.islice(reader, max_rows))
+        input_total_rows = len(rows) + sum(1 for _ in reader)
+
+    # One pass over the rows, tallying existing sequences as we go.
+    indices_by_key: dict[str, list[int]] = defaultdict(list)
+    compounds_by_key: dict[str, set[str]] = defaultdict(set)
+    modifications_by_key: dict[str, set[str]] = defaultdict(set)
+    sequences_by_key: dict[str, Counter[str]] = defaultdict(Counter)
     for idx, row in enumerate(rows):
         compound = row.get("compound", "") or ""
         canonical = canonicalize_compound(compound)
-        entry = grouped.setdefault(
-            canonical,
-            {
-                "indices": [],
-                "compounds": set(),
-                "modifications": set(),
-                "existing_sequences": [],
-            },
-        )
-        entry["indices"].append(idx)
-        entry["compounds"].add(compound)
+        indices_by_key[canonical].append(idx)
+        compounds_by_key[canonical].add(compound)
         mod = (row.get("modification") or "").strip()
         if mod:
-            entry["modifications"].add(mod)
+            modifications_by_key[canonical].add(mod)
         seq = (row.get("full_sequence") or "").strip()
         if seq:
-            entry["existing_sequences"].append(seq)
+            sequences_by_key[canonical][seq] += 1
 
     jobs = []
-    for canonical, entry in grouped.items():
-        counts = Counter(entry["existing_sequences"])
+    for canonical in indices_by_key:
         existing = [
             {"sequence": seq, "count": count}
-            for seq, count in counts.most_common(10)
+            for seq, count in sequences_by_key[canonical].most_common(10)
         ]
         payload = {
             "canonical_compound": canonical,
-            "compound_variants": sorted(entry["compounds"])[:10],
-            "modification_notes": sorted(entry["modifications"])[:10],
+            "compound_variants": sorted(compounds_by_key[canonical])[:10],
+            "modification_notes": sorted(modifications_by_key[canonical])[:10],
             "existing_full_sequences": existing,
         }
         jobs.append(
@@ -222,9 +311,45 @@ def main() -> None:
             }
         )
 
+    # Cache per compound rather than per batch, so hits don't depend on how
+    # compounds happen to be grouped. The key covers the prompt version and
+    # rules, the model, the peptides.html Codex reads, and the payload itself.
+    prompt_rules = build_prompt("")
+    job_keys = [
+        cache_key(
+            PROMPT_VERSION,
+            CODEX_MODEL,
+            prompt_rules,
+            peptides_html_hash,
+            json.dumps(job["payload"], ensure_ascii=False, sort_keys=True),
+        )
+        for job in jobs
+    ]
+    cache_keys: dict[str, str] = {}
     results: list[dict[str, object]] = []
-    for batch in chunked(jobs, DEFAULT_MAX_PARALLEL):
-        results.extend(list(run_codex.map(batch)))
+    pending = []
+    for job, key, cached in zip(jobs, job_keys, cache_get_many(job_keys)):
+        if isinstance(cached, dict):
+            results.append(cached)
+        else:
+            cache_keys[job["key"]] = key
+            pending.append(job)
+
+    # One map over every batch; max_containers bounds concurrency, so later
+    # batches start as soon as a container frees up instead of in waves.
+    # Each batch is cached as it arrives, so a failed batch later in the run
+    # doesn't cost the ones already finished.
+    batches = (
+        pending[idx : idx + CODEX_BATCH_SIZE]
+        for idx in range(0, len(pending), CODEX_BATCH_SIZE)
+    )
+    for batch_results in run_codex.map(
+        batches,
+        kwargs={"model": CODEX_MODEL},
+        order_outputs=False,
+    ):
+        cache_put({cache_keys[result["key"]]: result for result in batch_results})
+        results.extend(batch_results)
 
     results_by_key = {result["key"]: result for result in results}
 
@@ -233,9 +358,9 @@ def main() -> None:
     missing_rows = []
     missing_compounds = set()
 
-    for canonical, entry in grouped.items():
+    for canonical, indices in indices_by_key.items():
         result = results_by_key.get(canonical)
-        for idx in entry["indices"]:
+        for idx in indices:
             row = rows[idx]
             if not result:
                 missing_rows.append(row)
@@ -255,7 +380,7 @@ def main() -> None:
                 missing_compounds.add(row.get("compound", ""))
 
     report = {
-        "input_total_rows": len(all_rows),
+        "input_total_rows": input_total_rows,
         "processed_rows": len(rows),
         "normalized_count": normalized_count,
         "filled_count": filled_count,
@@ -265,9 +390,9 @@ def main() -> None:
 
     args.output_csv.parent.mkdir(parents=True, exist_ok=True)
     with args.output_csv.open("w", encoding="utf-8", newline="") as handle:
-        writer = csv.DictWriter(handle, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(rows)
+        writer = csv.writer(handle)
+        writer.writerow(fieldnames)
+        writer.writerows(project_rows(rows, fieldnames))
 
     args.report_path.parent.mkdir(parents=True, exist_ok=True)
     args.report_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
@@ -275,12 +400,15 @@ def main() -> None:
     if missing_rows:
         args.missing_output_csv.parent.mkdir(parents=True, exist_ok=True)
         with args.missing_output_csv.open("w", encoding="utf-8", newline="") as handle:
-            writer = csv.DictWriter(handle, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(missing_rows)
+            writer = csv.writer(handle)
+            writer.writerow(fieldnames)
+            writer.writerows(project_rows(missing_rows, fieldnames))
 
     print(json.dumps(report, indent=2))
 
 
-def chunked(items: list[dict[str, object]], size: int) -> list[list[dict[str, object]]]:
-    return [items[idx : idx + size] for idx in range(0, len(items), size)]
+def project_rows(
+    rows: list[dict[str, str]], fieldnames: list[str]
+) -> Iterator[list[str]]:
+    """Rows as positional lists in header order, for csv.writer."""
+    return ([row.get(field, "") for field in fieldnames] for row in rows)
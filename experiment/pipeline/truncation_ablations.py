@@ -1,7 +1,11 @@
 from __future__ import annotations
 
+import asyncio
 import csv
+import functools
+import hashlib
 import io
+import itertools
 import json
 import os
 import re
@@ -15,6 +19,22 @@ CODEX_SECRET_NAME = os.getenv("MODAL_CODEX_SECRET", "codex-api-key")
 
 CONFIG_PATH = Path(os.getenv("TRUNCATIONS_CONFIG", "pipeline/config/truncation.json"))
 DEFAULT_MAX_PARALLEL = int(os.getenv("MAX_PARALLEL", "15"))
+CSV_PATH_PLACEHOLDER = "\x00csv_path\x00"
+# Passed to codex exec -m when set; empty keeps codex's own default model.
+CODEX_MODEL = os.getenv("CODEX_MODEL", "")
+# Part of every cache key; bump when the prompt or how its output is parsed
+# changes, so earlier results are not served for the new version.
+PROMPT_VERSION = "1"
+# Codex results keyed by prompt hash. A named Dict rather than a local
+# directory, since run_codex containers (and their disks) are ephemeral.
+# Set CODEX_CACHE="" to disable.
+CODEX_CACHE_NAME = os.getenv("CODEX_CACHE", "capable-codex-cache")
+CODEX_CACHE = (
+    modal.Dict.from_name(CODEX_CACHE_NAME, create_if_missing=True)
+    if CODEX_CACHE_NAME
+    else None
+)
+CACHE_LOOKUP_CONCURRENCY = 64
 
 
 def load_config(path: Path) -> dict[str, object]:
@@ -28,25 +48,39 @@ def make_seeds(count: int, seed_start: int) -> list[int]:
     return list(range(seed_start, seed_start + count))
 
 
-def load_csv_rows(csv_path: Path) -> tuple[list[dict[str, str]], list[str]]:
+def load_csv_rows(
+    csv_path: Path,
+    limit: int | None = None,
+) -> tuple[list[dict[str, str]], list[str]]:
     if not csv_path.exists():
         raise SystemExit(f"Missing input CSV: {csv_path}")
     with csv_path.open("r", newline="", encoding="utf-8") as handle:
         reader = csv.DictReader(handle)
-        rows = list(reader)
+        # Truncations only ever use a prefix, so stop reading past the largest.
+        rows = list(itertools.islice(reader, limit))
         fieldnames = reader.fieldnames or []
     if not fieldnames:
         raise SystemExit(f"Missing header in {csv_path}")
     return rows, fieldnames
 
 
-def format_rows(rows: list[dict[str, str]], fieldnames: list[str]) -> str:
+def format_row_prefixes(
+    rows: list[dict[str, str]],
+    fieldnames: list[str],
+    row_counts: list[int],
+) -> dict[int, str]:
+    """CSV text of rows[:n] for each n, serializing every row only once."""
     output = io.StringIO()
     writer = csv.writer(output)
     writer.writerow(fieldnames)
-    for row in rows:
-        writer.writerow([row.get(field, "") for field in fieldnames])
-    return output.getvalue().strip()
+    texts: dict[int, str] = {}
+    written = 0
+    for n_results in sorted(row_counts):
+        for row in rows[written:n_results]:
+            writer.writerow([row.get(field, "") for field in fieldnames])
+        written = max(written, n_results)
+        texts[n_results] = output.getvalue().strip()
+    return texts
 
 
 def build_prompt(
@@ -84,17 +118,55 @@ def build_prompt(
         "- N-Me-L-Lys -> N-Me-Lys\n"
     )
 
+@functools.lru_cache(maxsize=8)
+def tag_pattern(tag: str) -> re.Pattern[str]:
+    escaped = re.escape(tag)
+    return re.compile(rf"<{escaped}>(.*?)</{escaped}>", re.DOTALL | re.IGNORECASE)
+
+
 def extract_tags(text: str, tag: str) -> list[str]:
-    matches = re.findall(
-        rf"<{tag}>(.*?)</{tag}>",
-        text,
-        flags=re.DOTALL | re.IGNORECASE,
-    )
-    return [match.strip() for match in matches if match.strip()]
+    matches = (match.group(1).strip() for match in tag_pattern(tag).finditer(text))
+    return [match for match in matches if match]
+
+
+def cache_key(*parts: str) -> str:
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+def cache_get_many(keys: list[str]) -> list[object | None]:
+    """Look keys up concurrently (the Dict has no bulk get); misses are None."""
+    if CODEX_CACHE is None or not keys:
+        return [None] * len(keys)
+    sem = asyncio.Semaphore(CACHE_LOOKUP_CONCURRENCY)
+
+    async def lookup(key: str) -> object | None:
+        async with sem:
+            try:
+                return await CODEX_CACHE.get.aio(key)
+            except Exception:
+                return None
 
+    async def lookup_all() -> list[object | None]:
+        return await asyncio.gather(*(lookup(key) for key in keys))
 
-def chunked(items: list[dict[str, object]], size: int) -> list[list[dict[str, object]]]:
-    return [items[idx : idx + size] for idx in range(0, len(items), size)]
+    try:
+        return asyncio.run(lookup_all())
+    except Exception:
+        return [None] * len(keys)
+
+
+def codex_command(model: str) -> list[str]:
+    model_args = ["-m", model] if model else []
+    return ["codex", "exec", "--yolo", *model_args, "-"]
+
+
+def cache_put(entries: dict[str, object]) -> None:
+    if CODEX_CACHE is None or not entries:
+        return
+    try:
+        CODEX_CACHE.update(entries)
+    except Exception:
+        pass
 
 
 app = modal.App(APP_NAME)
@@ -111,6 +183,7 @@ image = (
 @app.function(
     image=image,
     secrets=[modal.Secret.from_name(CODEX_SECRET_NAME)],
+    max_containers=DEFAULT_MAX_PARALLEL,
 )
 def run_codex(job: dict[str, object]) -> dict[str, object]:
     workspace = Path("/repo")
@@ -120,10 +193,11 @@ def run_codex(job: dict[str, object]) -> dict[str, object]:
     csv_path.write_text(str(job["rows_text"]), encoding="utf-8")
     prompt = str(job["prompt"])
     result = subprocess.run(
-        ["codex", "exec", "--yolo", "-"],
+        codex_command(str(job["model"])),
         cwd=str(workspace),
         capture_output=True,
-        text=True,
+        encoding="utf-8",
+        errors="replace",
         input=prompt,
         check=False,
     )
@@ -155,6 +229,7 @@ def main() -> None:
     base_prompt = str(config.get("base_prompt", "")).strip()
     response_tag = str(config.get("response_tag", "")).strip()
     max_parallel = int(config.get("max_parallel", DEFAULT_MAX_PARALLEL))
+    run_id = str(config.get("run_id", ""))
 
     if not input_path:
         raise SystemExit("Config missing input_csv.")
@@ -176,18 +251,24 @@ def main() -> None:
     seeds = make_seeds(seed_count, seed_start)
     row_counts = sorted(set(int(value) for value in row_counts))
 
-    rows, fieldnames = load_csv_rows(input_path)
-
     max_count = max(row_counts)
+    rows, fieldnames = load_csv_rows(input_path, limit=max_count)
+
     if max_count > len(rows):
         raise SystemExit(
             f"Requested {max_count} rows but only {len(rows)} available in {input_path}."
         )
 
+    # Each truncation is a prefix of the next, so the CSV is written once.
+    rows_text_by_count = format_row_prefixes(rows, fieldnames, row_counts)
+
+    # Only the CSV path differs between jobs, so the prompt is built once and
+    # the path substituted per job.
+    prompt_template = build_prompt(CSV_PATH_PLACEHOLDER, base_prompt, response_tag)
+
     jobs: list[dict[str, object]] = []
     for n_results in row_counts:
-        subset = rows[:n_results]
-        rows_text = format_rows(subset, fieldnames)
+        rows_text = rows_text_by_count[n_results]
         for seed in seeds:
             csv_path = f"truncations/trunc_{n_results}_{seed}.csv"
             jobs.append(
@@ -196,25 +277,51 @@ def main() -> None:
                     "seed": seed,
                     "csv_path": csv_path,
                     "rows_text": rows_text,
-                    "prompt": build_prompt(
-                        csv_path,
-                        base_prompt,
-                        response_tag,
-                    ),
+                    "prompt": prompt_template.replace(CSV_PATH_PLACEHOLDER, csv_path),
                     "response_tag": response_tag,
+                    "model": CODEX_MODEL,
                 }
             )
 
-    results: list[dict[str, object]] = []
-    for batch in chunked(jobs, max_parallel):
-        results.extend(list(run_codex.map(batch)))
+    # The prompt only names the CSV, so its contents are part of the key too.
+    # The path embeds the seed, so each seed remains a separate sample, but a
+    # re-run with the same seeds reuses the earlier samples instead of
+    # resampling. Set a new run_id in the config (or new seeds) to draw fresh
+    # ones.
+    job_keys = [
+        cache_key(
+            PROMPT_VERSION,
+            CODEX_MODEL,
+            run_id,
+            str(job["prompt"]),
+            str(job["rows_text"]),
+        )
+        for job in jobs
+    ]
+    cached_results = cache_get_many(job_keys)
+    pending = [
+        job for job, cached in zip(jobs, cached_results) if not isinstance(cached, dict)
+    ]
 
     output_path.parent.mkdir(parents=True, exist_ok=True)
     fieldnames = ["n_results", "seed", "parsed_peptides", "response_text"]
+    rows_written = 0
     with output_path.open("w", newline="", encoding="utf-8") as handle:
         writer = csv.DictWriter(handle, fieldnames=fieldnames)
         writer.writeheader()
-        for result in results:
+        # One map over every uncached job; max_containers bounds concurrency,
+        # so later jobs start as soon as a container frees up instead of in
+        # waves. Rows are written (and flushed) as results arrive, so a partial
+        # run still leaves its finished rows on disk.
+        fresh = iter(run_codex.with_options(max_containers=max_parallel).map(pending))
+        for key, cached in zip(job_keys, cached_results):
+            if isinstance(cached, dict):
+                result = cached
+            else:
+                result = next(fresh)
+                cache_put({key: result})
             writer.writerow(result)
+            handle.flush()
+            rows_written += 1
 
-    print(f"Wrote {len(results)} rows to {output_path}")
+    print(f"Wrote {rows_written} rows to {output_path}")
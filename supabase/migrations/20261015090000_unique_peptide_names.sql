@@ -0,0 +1,70 @@
+-- Enforce unique peptide names at the database layer.
+-- Peptide create/update rely on this constraint (SQLSTATE 23505) instead of
+-- issuing a separate duplicate-name lookup before every write.
+
+-- Existing duplicates would make the constraint fail, so merge them first.
+-- Nothing references peptides.id (experiments point at peptides by name), so
+-- each name keeps its lowest id and absorbs the others' data.
+lock table public.peptides in share row exclusive mode;
+
+with dupes as (
+    select id, min(id) over (partition by name) as keep_id
+    from public.peptides
+    where name is not null
+),
+groups as (
+    select keep_id
+    from dupes
+    group by keep_id
+    having count(*) > 1
+),
+members as (
+    select d.keep_id, p.*
+    from dupes d
+    join groups g using (keep_id)
+    join public.peptides p on p.id = d.id
+),
+-- First non-empty value in id order, so the kept row's own value wins.
+merged_fields as (
+    select
+        keep_id,
+        (array_agg(sequence order by id) filter (where coalesce(sequence, '') <> ''))[1] as sequence,
+        (array_agg(notes order by id) filter (where coalesce(notes, '') <> ''))[1] as notes,
+        (array_agg(logs order by id) filter (where coalesce(logs, '') <> ''))[1] as logs
+    from members
+    group by keep_id
+),
+-- Union of experiment links, each kept once in first-seen order.
+first_links as (
+    select distinct on (m.keep_id, link.entry::jsonb)
+        m.keep_id, link.entry, m.id, link.ord
+    from members m
+    cross join lateral unnest(m.experiments) with ordinality as link(entry, ord)
+    order by m.keep_id, link.entry::jsonb, m.id, link.ord
+),
+merged_links as (
+    select keep_id, array_agg(entry order by id, ord) as experiments
+    from first_links
+    group by keep_id
+)
+update public.peptides p
+set
+    sequence = coalesce(f.sequence, p.sequence),
+    notes = coalesce(f.notes, p.notes),
+    logs = coalesce(f.logs, p.logs),
+    experiments = coalesce(l.experiments, p.experiments)
+from merged_fields f
+left join merged_links l using (keep_id)
+where p.id = f.keep_id;
+
+delete from public.peptides p
+using (
+    select id, min(id) over (partition by name) as keep_id
+    from public.peptides
+    where name is not null
+) d
+where p.id = d.id
+  and d.id <> d.keep_id;
+
+alter table if exists public.peptides
+add constraint peptides_name_key unique (name);
@@ -0,0 +1,15 @@
+-- Cache OpenAI peptide extraction results per experiment name.
+-- The sync cron looks names up here (by sha256 of the extraction prompt
+-- version and the name) before calling OpenAI, so repeat runs only pay for
+-- names it has not seen yet, and editing the prompt invalidates old results.
+create table if not exists public.peptide_name_cache (
+    name_hash text primary key,
+    peptides text[] not null default '{}',
+    created_at timestamp with time zone not null default now()
+);
+
+-- Only the service role (which bypasses RLS) reads or writes the cache.
+alter table public.peptide_name_cache enable row level security;
+
+comment on table public.peptide_name_cache is
+'Peptide names extracted from an experiment name, keyed by sha256(prompt version, experiment name).';
@@ -0,0 +1,84 @@
+-- Recompute experiments.peptides from peptides.experiments links in one
+-- statement, so the backfill no longer downloads both tables to diff them
+-- in Python. Called via RPC when USE_RPC_BACKFILL is set; mirrors the
+-- Python path: distinct trimmed names ordered case-insensitively (ties
+-- broken by the exact name in code point order), NULL when an experiment has
+-- no linked peptides, and rows already equal as sets are left untouched.
+create or replace function public.fn_recompute_experiments_peptides(
+    target_ids uuid[] default null
+)
+returns jsonb
+language sql
+set search_path = public
+as $$
+with targets as (
+    select x.id, x.peptides
+    from public.experiments x
+    where target_ids is null or x.id = any(target_ids)
+),
+links as (
+    select distinct btrim(kv.value) as exp_id, btrim(p.name) as name
+    from public.peptides p
+    cross join lateral unnest(p.experiments) as e(link)
+    cross join lateral json_each_text(
+        case when json_typeof(e.link) = 'object' then e.link else '{}'::json end
+    ) as kv
+    where btrim(coalesce(p.name, '')) <> ''
+      and btrim(coalesce(kv.value, '')) <> ''
+),
+expected as (
+    select
+        t.id,
+        array(
+            select distinct btrim(c)
+            from unnest(t.peptides) as c
+            where btrim(coalesce(c, '')) <> ''
+        ) as current_names,
+        (
+            select array_agg(l.name order by lower(l.name) collate "C", l.name collate "C")
+            from links l
+            where l.exp_id = t.id::text
+        ) as peptides
+    from targets t
+),
+changed as (
+    select id, peptides
+    from expected
+    where not (
+        coalesce(peptides, '{}') @> current_names
+        and current_names @> coalesce(peptides, '{}')
+    )
+),
+updated as (
+    update public.experiments x
+    set peptides = c.peptides
+    from changed c
+    where x.id = c.id
+    returning x.peptides
+)
+select jsonb_build_object(
+    'updated_experiments', (select count(*) from updated),
+    'unchanged_experiments', (select count(*) from targets) - (select count(*) from updated),
+    'cleared_experiments', (select count(*) from updated where peptides is null),
+    'total_experiments', (select count(*) from targets),
+    'total_peptides', (select count(*) from public.peptides),
+    'unresolved_links', case
+        when target_ids is null then (
+            select count(*)
+            from links l
+            where not exists (
+                select 1 from public.experiments x where x.id::text = l.exp_id
+            )
+        )
+        else 0
+    end
+);
+$$;
+
+-- Default privileges grant execute to anon/authenticated; this rewrites
+-- experiments, so only the service role may call it.
+revoke execute on function public.fn_recompute_experiments_peptides(uuid[]) from public, anon, authenticated;
+grant execute on function public.fn_recompute_experiments_peptides(uuid[]) to service_role;
+
+comment on function public.fn_recompute_experiments_peptides(uuid[]) is
+'Recompute experiments.peptides from peptides.experiments links (all experiments, or only target_ids).';